@@ -42,17 +42,20 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-from scipy.stats import t
 import warnings
 warnings.filterwarnings('ignore')
 import copy
+from walmart_ci import (load_cached, PurchaseCube, sales_table, QuantileSketch, segment_sketches, kde_curve,
+                        segment_bootstrap, confidence_intervals, sums_to_stats, analytic_intervals, ci_table,
+                        SegmentIndex, compare_means, pairwise_comparisons, BootstrapCache)
 
 
 # In[2]:
 
 
-# loading the dataset
-df = pd.read_csv('walmart_data.txt')
+# loading the dataset, purchase as int32 and the other columns as category
+# the cleaned frame is cached next to the file and rebuilt when the file changes (see load_cached)
+df = load_cached('walmart_data.txt')
 
 
 # In[3]:
@@ -83,15 +86,13 @@ df.info()
 # 
 # * From the above analysis, it is clear that, data has total of 10 features with lots of mixed alpha numeric data.
 # 
-# * Apart from Purchase Column, all the other data types are of categorical type. We will change the datatypes of all such columns to category
+# * Apart from Purchase Column, all the other data types are of categorical type. All such columns are read as category while loading the data
 
 # In[7]:
 
 
-for i in df.columns[:-1]:
-    df[i] = df[i].astype('category')
-
-df.info()
+#all the columns except purchase were already loaded as category
+df.dtypes
 
 
 # # Statistical Summary
@@ -205,7 +206,10 @@ ax0.set_title('Purchase Amount Distribution',{'font':'serif', 'size':15,'weight'
                                      #creating box plot for purchase amount
             
 ax1 = fig.add_subplot(gs[1,0])
-boxplot = ax1.boxplot(x = df['Purchase'],vert = False,patch_artist = True,widths = 0.5)
+
+#box plot statistics from a quantile sketch of purchase amount, one bincount over the column
+purchase_sketch = QuantileSketch().update(df['Purchase'])
+boxplot = ax1.bxp([purchase_sketch.boxplot_stats()],vert = False,patch_artist = True,widths = 0.5)
 
 # Customize box and whisker colors
 boxplot['boxes'][0].set(facecolor='#5C8374')
@@ -224,7 +228,7 @@ for s in ['top','left','right']:
 #adding 5 point summary annotations
 info = [i.get_xdata() for i in boxplot['whiskers']] #getting the upperlimit,Q1,Q3 and lowerlimit
 
-median = df['Purchase'].quantile(0.5) #getting Q2
+median = purchase_sketch.quantile(0.5) #getting Q2
 
 for i,j in info: #using i,j here because of the output type of info list comprehension
     
@@ -590,15 +594,18 @@ for i,j,k in [(0,0,'Gender'),(0,1,'City_Category'),(1,0,'Marital_Status'),(1,1,'
     else:
         ax0 = fig.add_subplot(gs[i,:])
         
-    #plot
+    #plot from the quantile sketch of each group
     color_map = ["#3A7089", "#4b4b4c",'#99AEBB','#5C8374','#6F7597','#7A9D54','#9EB384']
-    sns.boxplot(data = df, x = k, y  = 'Purchase' ,ax = ax0,width = 0.5, palette =color_map)
+    sketches = segment_sketches(df,k)
+    boxes = ax0.bxp([sketches[g].boxplot_stats(label = g) for g in sketches],patch_artist = True,widths = 0.5)
+    for box,c in zip(boxes['boxes'],color_map):
+        box.set(facecolor = c)
 
     #plot title
     ax0.set_title(f'Purchase Amount Vs {k}',{'font':'serif', 'size':12,'weight':'bold'})
     
     #customizing axis
-    ax0.set_xticklabels(df[k].unique(),fontweight = 'bold',fontsize = 12)
+    ax0.set_xticklabels(list(sketches),fontweight = 'bold',fontsize = 12)
     ax0.set_ylabel('Purchase Amount',fontweight = 'bold',fontsize = 12)
     ax0.set_xlabel('')
     
@@ -612,20 +619,20 @@ plt.show()
 # ### Gender VS Purchase Amount
 # ##### Data Visualization
 
-# In[24]:
+# In[ ]:
 
 
-#creating a df for purchase amount vs gender
-temp = df.groupby('Gender')['Purchase'].agg(['sum','count']).reset_index()
+#count, sum and sum of squares of purchase amount for every combination of the customer columns
+#every table of purchase amount by a customer column below is a roll up of this cube
+cube = PurchaseCube(df)
 
-#calculating the amount in billions
-temp['sum_in_billions'] = round(temp['sum'] / 10**9,2)
 
-#calculationg percentage distribution of purchase amount
-temp['%sum'] = round(temp['sum']/temp['sum'].sum(),3)
+# In[24]:
+
 
-#calculationg per purchase amount
-temp['per_purchase'] = round(temp['sum']/temp['count'])
+#creating a df for purchase amount vs gender
+#sum, count, amount in billions, percentage distribution and per purchase amount from the purchase cube
+temp = sales_table(cube.rollup('Gender'))
 
 #renaming the gender
 temp['Gender'] = temp['Gender'].replace({'F':'Female','M':'Male'})
@@ -633,6 +640,32 @@ temp['Gender'] = temp['Gender'].replace({'F':'Female','M':'Male'})
 temp
 
 
+# In[ ]:
+
+
+#defining a function for plotting a kde curve computed on a binned grid (see kde_curve)
+#weights are the number of times each value occurs, scale multiplies the density
+
+def kdeplot(ax,data,color,label = None,alpha = 0.5,weights = None,scale = 1):
+    x,density = kde_curve(data,weights)
+    ax.fill_between(x,density * scale,facecolor = color,edgecolor = color,alpha = alpha,label = label)
+
+
+#defining a function for plotting the purchase amount kde curve of each group of a column
+#curves are computed from the quantile sketch of each group and scaled by the group's share of rows
+
+def kdeplot_groups(ax,column,groups,colors,alpha = 0.5):
+    sketches = segment_sketches(df,column)
+    total = sum(sk.count for sk in sketches.values())
+
+    #later groups are drawn first, so the first group stays on top
+    for g,c in list(zip(groups,colors))[::-1]:
+        kdeplot(ax,sketches[g].values(),c,g,alpha,sketches[g].counts,sketches[g].count / total)
+
+    handles,labels = ax.get_legend_handles_labels()
+    ax.legend(handles[::-1],labels[::-1],title = column)
+
+
 # In[25]:
 
 
@@ -730,7 +763,7 @@ ax2.set_title('Gender-Based Transaction Distribution',{'font':'serif', 'size':15
 ax3 = fig.add_subplot(gs[2,:])
 
 #plotting the kdeplot
-sns.kdeplot(data = df, x = 'Purchase', hue = 'Gender', palette = color_map,fill = True, alpha = 1,ax = ax3)
+kdeplot_groups(ax3,'Gender',['F','M'],color_map,alpha = 1)
 
 #removing the axis lines
 for s in ['top','left','right']:
@@ -792,71 +825,52 @@ def confidence_interval(data,ci):
 # In[27]:
 
 
-#defining a function for plotting the visual for given confidence interval
-
-def plot(ci):
+#sample sizes to be taken from purchase amount
+sample_sizes = [100,1000,5000,50000]
 
-    #setting the plot style
-    fig = plt.figure(figsize = (15,8))
-    gs = fig.add_gridspec(2,2)
+#number of samples to be taken from purchase amount
+bootstrap_samples = 20000
 
-    #creating separate data frames for each gender
-    df_male = df.loc[df['Gender'] == 'M','Purchase']
-    df_female = df.loc[df['Gender'] == 'F','Purchase']
+#working memory allowed for the bootstrap, such as '2G' on small machines (None for no limit)
+memory_budget = None
 
-    #sample sizes and corresponding plot positions
-    sample_sizes = [(100,0,0),(1000,0,1),(5000,1,0),(50000,1,1)]
+#stop adding replicates to a sample size once every interval endpoint is known to within tol dollars,
+#bootstrap_samples is then the upper limit (None always draws bootstrap_samples)
+tol = None
 
-    #number of samples to be taken from purchase amount
-    bootstrap_samples = 20000
+#fixed seed, so that re-running the notebook reuses the bootstrap means saved on disk
+#instead of resampling (the cache keeps at most 1 GB, dropping the least recently used runs)
+seed = 0
+bootstrap_cache = BootstrapCache('walmart_data.txt.bootstrap')
 
-    male_samples = {}
-    female_samples = {}
-    
-    for i,x,y in sample_sizes:
-        male_means = [] #list for collecting the means of male sample
-        female_means = [] #list for collecting the means of female sample
+#defining a function for plotting the visual for given confidence interval
+#means are the bootstrapped sample means of each group (see segment_bootstrap)
 
-        for j in range(bootstrap_samples):
+def plot(means,ci,groups,colors,labels = None,grid = (2,2),figsize = (15,8),ci_lines = True):
 
-            #creating random 5000 samples of i sample size
-            male_bootstrapped_samples = np.random.choice(df_male,size = i)
-            female_bootstrapped_samples = np.random.choice(df_female,size = i)
+    #setting the plot style
+    fig = plt.figure(figsize = figsize)
+    gs = fig.add_gridspec(*grid)
 
-            #calculating mean of those samples
-            male_sample_mean = np.mean(male_bootstrapped_samples)
-            female_sample_mean = np.mean(female_bootstrapped_samples)
+    #storing the samples generated for each group
+    samples = {g:{f'{ci}%_{i}':means[g][i] for i in sample_sizes} for g in groups}
 
-            #appending the mean to the list
-            male_means.append(male_sample_mean)
-            female_means.append(female_sample_mean)
-            
-        #storing the above sample generated
-        male_samples[f'{ci}%_{i}'] = male_means
-        female_samples[f'{ci}%_{i}'] = female_means
-
-        #creating a temporary dataframe for creating kdeplot
-        temp_df = pd.DataFrame(data = {'male_means':male_means,'female_means':female_means})
+    for x,i in enumerate(sample_sizes):
 
                                                         #plotting kdeplots
         #plot position
-        ax = fig.add_subplot(gs[x,y])
-        
-        #plots for male and female
-        sns.kdeplot(data = temp_df,x = 'male_means',color ="#3A7089" ,fill = True, alpha = 0.5,ax = ax,label = 'Male')
-        sns.kdeplot(data = temp_df,x = 'female_means',color ="#4b4b4c" ,fill = True, alpha = 0.5,ax = ax,label = 'Female')
-
-        #calculating confidence intervals for given confidence level(ci)
-        m_range = confidence_interval(male_means,ci)
-        f_range = confidence_interval(female_means,ci)
+        ax = fig.add_subplot(gs[x])
 
-        #plotting confidence interval on the distribution
-        for k in m_range:
-            ax.axvline(x = k,ymax = 0.9, color ="#3A7089",linestyle = '--')
+        for g,c in zip(groups,colors):
+            label = g if labels is None else labels[g]
 
-        for k in f_range:
-            ax.axvline(x = k,ymax = 0.9, color ="#4b4b4c",linestyle = '--')
+            #plots for each group
+            kdeplot(ax,means[g][i],c,label)
 
+            #plotting confidence interval on the distribution
+            if ci_lines:
+                for k in confidence_interval(means[g][i],ci):
+                    ax.axvline(x = k,ymax = 0.9, color = c,linestyle = '--')
 
         #removing the axis lines
         for s in ['top','left','right']:
@@ -877,25 +891,32 @@ def plot(ci):
 
     plt.show()
     
-    return male_samples,female_samples
+    return samples
 
 
 # In[28]:
 
 
-m_samp_90,f_samp_90 = plot(90)
+#bootstrapping the sample means once, all confidence levels are read from the same samples
+gender_means = segment_bootstrap(df,'Gender',sample_sizes,bootstrap_samples,rng = seed,memory_budget = memory_budget,
+                                 cache = bootstrap_cache,tol = tol,levels = [90,95,99])
+
+samples = plot(gender_means,90,['M','F'],["#3A7089","#4b4b4c"],labels = {'M':'Male','F':'Female'})
+m_samp_90,f_samp_90 = samples['M'],samples['F']
 
 
 # In[29]:
 
 
-m_samp_95,f_samp_95 = plot(95)
+samples = plot(gender_means,95,['M','F'],["#3A7089","#4b4b4c"],labels = {'M':'Male','F':'Female'})
+m_samp_95,f_samp_95 = samples['M'],samples['F']
 
 
 # In[31]:
 
 
-m_samp_99,f_samp_99 = plot(99)
+samples = plot(gender_means,99,['M','F'],["#3A7089","#4b4b4c"],labels = {'M':'Male','F':'Female'})
+m_samp_99,f_samp_99 = samples['M'],samples['F']
 
 
 # # Are confidence intervals of average male and female spending overlapping?
@@ -906,19 +927,19 @@ m_samp_99,f_samp_99 = plot(99)
 fig = plt.figure(figsize = (20,10))
 gs = fig.add_gridspec(3,1)
 
-for i,j,k,l in [(m_samp_90,f_samp_90,90,0),(m_samp_95,f_samp_95,95,1),(m_samp_99,f_samp_99,99,2)]:
+#finding ci at all confidence levels for each gender and sample size
+gender_ci = {g:{i:confidence_intervals(gender_means[g][i],[90,95,99]) for i in sample_sizes} for g in ['M','F']}
+
+for k,l in [(90,0),(95,1),(99,2)]:
     #list for collecting ci for given cl
     m_ci = ['Male'] 
     f_ci = ['Female'] 
     
-    #finding ci for each sample size (males)
-    for m in i:  
-        m_range = confidence_interval(i[m],k)
+    #ci for each sample size
+    for i in sample_sizes:
+        m_range = gender_ci['M'][i][k]
+        f_range = gender_ci['F'][i][k]
         m_ci.append(f"CI = ${m_range[0]:.0f} - ${m_range[1]:.0f}, Range = {(m_range[1] - m_range[0]):.0f}")
-        
-    #finding ci for each sample size (females)
-    for f in j:  
-        f_range = confidence_interval(j[f],k)
         f_ci.append(f"CI = ${f_range[0]:.0f} - ${f_range[1]:.0f}, Range = {(f_range[1] - f_range[0]):.0f}")
     
                                         #plotting the summary
@@ -941,6 +962,38 @@ for i,j,k,l in [(m_samp_90,f_samp_90,90,0),(m_samp_95,f_samp_95,95,1),(m_samp_99
     ax.set_title(f"{k}% Confidence Interval Summary",{'font':'serif', 'size':14,'weight':'bold'})
 
 
+# ##### Analytic Cross-check
+# * The same intervals can be computed directly from the count, mean and variance of each gender using the t-distribution, without any resampling. The bootstrap intervals above should agree with these closely.
+
+# In[ ]:
+
+
+#count, mean and variance of purchase amount per gender, from the purchase cube
+gender_stats = sums_to_stats(cube.rollup('Gender'))
+
+for k in [90,95,99]:
+    print(f"{k}% Confidence Interval (t-distribution)")
+    for row in ci_table(analytic_intervals(gender_stats,k,sample_sizes)):
+        print(row)
+    print('-'*70)
+
+
+# ##### Difference in Average Spending
+# * Overlap of two separate intervals is only an indirect test. Below the difference between male and female average spending is bootstrapped directly, and a permutation test gives its p value.
+
+# In[ ]:
+
+
+#purchase amounts of each gender without copying the data
+gender_index = SegmentIndex(df,'Gender')
+result = compare_means(gender_index['M'],gender_index['F'],[90,95,99],rng = seed,memory_budget = memory_budget,cache = bootstrap_cache)
+
+print(f"Difference in average spending (Male - Female) = ${result['difference']:.0f}")
+for k,(low,high) in result['intervals'].items():
+    print(f"{k}% Confidence Interval = ${low:.0f} - ${high:.0f}")
+print(f"Permutation test p value = {result['p_value']:.4f}")
+
+
 # ##### Insights
 # * Sample Size
 # 
@@ -978,16 +1031,8 @@ for i,j,k,l in [(m_samp_90,f_samp_90,90,0),(m_samp_95,f_samp_95,95,1),(m_samp_99
 
 
 #creating a df for purchase amount vs marital status
-temp = df.groupby('Marital_Status')['Purchase'].agg(['sum','count']).reset_index()
-
-#calculating the amount in billions
-temp['sum_in_billions'] = round(temp['sum'] / 10**9,2)
-
-#calculationg percentage distribution of purchase amount
-temp['%sum'] = round(temp['sum']/temp['sum'].sum(),3)
-
-#calculationg per purchase amount
-temp['per_purchase'] = round(temp['sum']/temp['count'])
+#sum, count, amount in billions, percentage distribution and per purchase amount from the purchase cube
+temp = sales_table(cube.rollup('Marital_Status'))
 
 temp
 
@@ -1090,8 +1135,7 @@ ax3 = fig.add_subplot(gs[2,:])
 color_map = [ "#4b4b4c","#3A7089"]
 
 #plotting the kdeplot
-sns.kdeplot(data = df, x = 'Purchase', hue = 'Marital_Status', palette = color_map,fill = True, alpha = 1,
-            ax = ax3,hue_order = ['Married','Unmarried'])
+kdeplot_groups(ax3,'Marital_Status',['Married','Unmarried'],color_map,alpha = 1)
 
 #removing the axis lines
 for s in ['top','left','right']:
@@ -1133,101 +1177,11 @@ plt.show()
 # * After building CLT curve, we will create a confidence interval predicting population mean at 95% Confidence level.
 # Note - We will use different sample sizes of [100,1000,5000,50000]
 
-# In[35]:
-
-
-#defining a function for plotting the visual for given confidence interval
-
-def plot(ci):
-
-    #setting the plot style
-    fig = plt.figure(figsize = (15,8))
-    gs = fig.add_gridspec(2,2)
-
-    #creating separate data frames 
-    df_married = df.loc[df['Marital_Status'] == 'Married','Purchase']
-    df_unmarried = df.loc[df['Marital_Status'] == 'Unmarried','Purchase']
-
-    #sample sizes and corresponding plot positions
-    sample_sizes = [(100,0,0),(1000,0,1),(5000,1,0),(50000,1,1)]
-
-    #number of samples to be taken from purchase amount
-    bootstrap_samples = 20000
-
-    married_samples = {}
-    unmarried_samples = {}
-    
-    for i,x,y in sample_sizes:
-        married_means = [] #list for collecting the means of married sample
-        unmarried_means = [] #list for collecting the means of unmarried sample
-
-        for j in range(bootstrap_samples):
-
-            #creating random 5000 samples of i sample size
-            married_bootstrapped_samples = np.random.choice(df_married,size = i)
-            unmarried_bootstrapped_samples = np.random.choice(df_unmarried,size = i)
-
-            #calculating mean of those samples
-            married_sample_mean = np.mean(married_bootstrapped_samples)
-            unmarried_sample_mean = np.mean(unmarried_bootstrapped_samples)
-
-            #appending the mean to the list
-            married_means.append(married_sample_mean)
-            unmarried_means.append(unmarried_sample_mean)
-            
-        #storing the above sample generated
-        married_samples[f'{ci}%_{i}'] = married_means
-        unmarried_samples[f'{ci}%_{i}'] = unmarried_means
-
-        #creating a temporary dataframe for creating kdeplot
-        temp_df = pd.DataFrame(data = {'married_means':married_means,'unmarried_means':unmarried_means})
-
-                                                        #plotting kdeplots
-        #plot position
-        ax = fig.add_subplot(gs[x,y])
-        
-        #plots for married and unmarried
-        sns.kdeplot(data = temp_df,x = 'married_means',color ="#3A7089" ,fill = True, alpha = 0.5,ax = ax,label = 'Married')
-        sns.kdeplot(data = temp_df,x = 'unmarried_means',color ="#4b4b4c" ,fill = True, alpha = 0.5,ax = ax,label = 'Unmarried')
-
-        #calculating confidence intervals for given confidence level(ci)
-        m_range = confidence_interval(married_means,ci)
-        u_range = confidence_interval(unmarried_means,ci)
-
-        #plotting confidence interval on the distribution
-        for k in m_range:
-            ax.axvline(x = k,ymax = 0.9, color ="#3A7089",linestyle = '--')
-
-        for k in u_range:
-            ax.axvline(x = k,ymax = 0.9, color ="#4b4b4c",linestyle = '--')
-
-
-        #removing the axis lines
-        for s in ['top','left','right']:
-            ax.spines[s].set_visible(False)
-
-        # adjusting axis labels
-        ax.set_yticks([])
-        ax.set_ylabel('')
-        ax.set_xlabel('')
-
-        #setting title for visual
-        ax.set_title(f'CLT Curve for Sample Size = {i}',{'font':'serif', 'size':11,'weight':'bold'})
-
-        plt.legend()
-    
-    #setting title for visual
-    fig.suptitle(f'{ci}% Confidence Interval',font = 'serif', size = 18, weight = 'bold')
-
-    plt.show()
-    
-    return married_samples,unmarried_samples
-
-
 # In[36]:
 
 
-m_samp_95,u_samp_95 = plot(95)
+samples = plot(segment_bootstrap(df,'Marital_Status',sample_sizes,bootstrap_samples,rng = seed,memory_budget = memory_budget,cache = bootstrap_cache,tol = tol),95,['Married','Unmarried'],["#3A7089","#4b4b4c"])
+m_samp_95,u_samp_95 = samples['Married'],samples['Unmarried']
 
 
 # # Are confidence intervals of average married and unmarried customer spending overlapping?
@@ -1272,6 +1226,19 @@ ax.set_title(f"95% Confidence Interval Summary",{'font':'serif', 'size':14,'weig
 plt.show()
 
 
+# ##### Difference in Average Spending
+
+# In[ ]:
+
+
+marital_index = SegmentIndex(df,'Marital_Status')
+result = compare_means(marital_index['Married'],marital_index['Unmarried'],[95],rng = seed,memory_budget = memory_budget,cache = bootstrap_cache)
+
+print(f"Difference in average spending (Married - Unmarried) = ${result['difference']:.0f}")
+print(f"95% Confidence Interval = ${result['intervals'][95][0]:.0f} - ${result['intervals'][95][1]:.0f}")
+print(f"Permutation test p value = {result['p_value']:.4f}")
+
+
 # #### Insights
 # * Sample Size
 # 
@@ -1301,16 +1268,8 @@ plt.show()
 
 
 #creating a df for purchase amount vs age group
-temp = df.groupby('Age')['Purchase'].agg(['sum','count']).reset_index()
-
-#calculating the amount in billions
-temp['sum_in_billions'] = round(temp['sum'] / 10**9,2)
-
-#calculationg percentage distribution of purchase amount
-temp['%sum'] = round(temp['sum']/temp['sum'].sum(),3)
-
-#calculationg per purchase amount
-temp['per_purchase'] = round(temp['sum']/temp['count'])
+#sum, count, amount in billions, percentage distribution and per purchase amount from the purchase cube
+temp = sales_table(cube.rollup('Age'))
 
 temp
 
@@ -1406,8 +1365,7 @@ ax1.set_title('Average Purchase Amount per Transaction',{'font':'serif', 'size':
 ax3 = fig.add_subplot(gs[2,:])
 
 #plotting the kdeplot
-sns.kdeplot(data = df, x = 'Purchase', hue = 'Age', palette = color_map,fill = True, alpha = 0.5,
-            ax = ax3)
+kdeplot_groups(ax3,'Age',list(df['Age'].cat.categories),color_map)
 
 #removing the axis lines
 for s in ['top','left','right']:
@@ -1451,118 +1409,14 @@ plt.show()
 # * After building CLT curve, we will create a confidence interval predicting population mean at 95% Confidence level.
 # * Note - We will use different sample sizes of [100,1000,5000,50000]
 
-# In[40]:
-
-
-#defining a function for plotting the visual for given confidence interval
-
-def plot(ci):
-
-    #setting the plot style
-    fig = plt.figure(figsize = (15,15))
-    gs = fig.add_gridspec(4,1)
-
-    #creating separate data frames 
-    
-    df_1 = df.loc[df['Age'] == '0-17','Purchase']
-    df_2 = df.loc[df['Age'] == '18-25','Purchase']
-    df_3 = df.loc[df['Age'] == '26-35','Purchase']
-    df_4 = df.loc[df['Age'] == '36-45','Purchase']
-    df_5 = df.loc[df['Age'] == '46-50','Purchase']
-    df_6 = df.loc[df['Age'] == '51-55','Purchase']
-    df_7 = df.loc[df['Age'] == '55+','Purchase']
-    
-
-    #sample sizes and corresponding plot positions
-    sample_sizes = [(100,0),(1000,1),(5000,2),(50000,3)]
-
-    #number of samples to be taken from purchase amount
-    bootstrap_samples = 20000
-
-    samples1,samples2,samples3,samples4,samples5,samples6,samples7 = {},{},{},{},{},{},{}
-    
-    for i,x in sample_sizes:
-        l1,l2,l3,l4,l5,l6,l7 = [],[],[],[],[],[],[]
-
-        for j in range(bootstrap_samples):
-
-            #creating random 5000 samples of i sample size
-            bootstrapped_samples_1 = np.random.choice(df_1,size = i)
-            bootstrapped_samples_2 = np.random.choice(df_2,size = i)
-            bootstrapped_samples_3 = np.random.choice(df_3,size = i)
-            bootstrapped_samples_4 = np.random.choice(df_4,size = i)
-            bootstrapped_samples_5 = np.random.choice(df_5,size = i)
-            bootstrapped_samples_6 = np.random.choice(df_6,size = i)
-            bootstrapped_samples_7 = np.random.choice(df_7,size = i)
-
-            #calculating mean of those samples
-            sample_mean_1 = np.mean(bootstrapped_samples_1)
-            sample_mean_2 = np.mean(bootstrapped_samples_2)
-            sample_mean_3 = np.mean(bootstrapped_samples_3)
-            sample_mean_4 = np.mean(bootstrapped_samples_4)
-            sample_mean_5 = np.mean(bootstrapped_samples_5)
-            sample_mean_6 = np.mean(bootstrapped_samples_6)
-            sample_mean_7 = np.mean(bootstrapped_samples_7)
-            
-            #appending the mean to the list
-            l1.append(sample_mean_1)
-            l2.append(sample_mean_2)
-            l3.append(sample_mean_3)
-            l4.append(sample_mean_4)
-            l5.append(sample_mean_5)
-            l6.append(sample_mean_6)
-            l7.append(sample_mean_7)
-
-        #storing the above sample generated
-        samples1[f'{ci}%_{i}'] = l1
-        samples2[f'{ci}%_{i}'] = l2
-        samples3[f'{ci}%_{i}'] = l3
-        samples4[f'{ci}%_{i}'] = l4
-        samples5[f'{ci}%_{i}'] = l5
-        samples6[f'{ci}%_{i}'] = l6
-        samples7[f'{ci}%_{i}'] = l7
-
-        
-        #creating a temporary dataframe for creating kdeplot
-        temp_df = pd.DataFrame(data = {'0-17':l1,'18-25':l2,'26-35':l3,'36-45':l4,'46-50':l5,'51-55':l6,'55+':l7})
-
-                                                        #plotting kdeplots
-        #plot position
-        ax = fig.add_subplot(gs[x])
-        
-        #plots
-        for p,q in [('#3A7089', '0-17'),('#4b4b4c', '18-25'),('#99AEBB', '26-35'),('#5C8374', '36-45'),('#6F7597', '46-50'),
-                 ('#7A9D54', '51-55'),('#9EB384', '55+')]:
-            
-            sns.kdeplot(data = temp_df,x = q,color =p ,fill = True, alpha = 0.5,ax = ax,label = q)
-
-
-        #removing the axis lines
-        for s in ['top','left','right']:
-            ax.spines[s].set_visible(False)
-
-        # adjusting axis labels
-        ax.set_yticks([])
-        ax.set_ylabel('')
-        ax.set_xlabel('')
-
-        #setting title for visual
-        ax.set_title(f'CLT Curve for Sample Size = {i}',{'font':'serif', 'size':11,'weight':'bold'})
-
-        plt.legend()
-    
-    #setting title for visual
-    fig.suptitle(f'{ci}% Confidence Interval',font = 'serif', size = 18, weight = 'bold')
-
-    plt.show()
-    
-    return samples1,samples2,samples3,samples4,samples5,samples6,samples7
-
-
 # In[41]:
 
 
-samples1,samples2,samples3,samples4,samples5,samples6,samples7 = plot(95)
+age_groups = ['0-17','18-25','26-35','36-45','46-50','51-55','55+']
+color_map = ["#3A7089", "#4b4b4c",'#99AEBB','#5C8374','#6F7597','#7A9D54','#9EB384']
+
+samples = plot(segment_bootstrap(df,'Age',sample_sizes,bootstrap_samples,rng = seed,memory_budget = memory_budget,cache = bootstrap_cache,tol = tol),95,age_groups,color_map,grid = (4,1),figsize = (15,15),ci_lines = False)
+samples1,samples2,samples3,samples4,samples5,samples6,samples7 = [samples[g] for g in age_groups]
 
 
 # # Are confidence intervals of customer's age-group spending overlapping?
@@ -1607,6 +1461,24 @@ ax.set_title(f"95% Confidence Interval Summary",{'font':'serif', 'size':14,'weig
 plt.show()
 
 
+# # Which age groups differ from each other?
+# * Instead of reading overlaps off the table, all 21 pairs of age groups are compared at once from a single bootstrap pass. P values are corrected for the 21 comparisons (Holm), and only the differences that stay significant at 5% are shown.
+
+# In[ ]:
+
+
+age_pairs = pairwise_comparisons(df,'Age',[95])
+
+#average spending difference (row - column), hiding pairs that are not significant
+fig,ax = plt.subplots(figsize = (10,7))
+sns.heatmap(age_pairs['difference'].loc[age_groups,age_groups],annot = True,fmt = '.0f',cmap = 'RdBu_r',center = 0,
+            mask = age_pairs['p_value'].loc[age_groups,age_groups] >= 0.05,linewidths = 0.5,ax = ax)
+
+ax.set_title("Difference in Average Spending between Age Groups ($)",{'font':'serif', 'size':14,'weight':'bold'})
+
+plt.show()
+
+
 # ### Insights
 # 
 # * Sample Size
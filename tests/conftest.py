@@ -0,0 +1,5 @@
+import os
+import sys
+
+#walmart_ci.py lives at the top of the repository, next to the notebook
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
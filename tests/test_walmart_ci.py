@@ -0,0 +1,411 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import bootstrap
+
+import walmart_ci as w
+
+
+def make_frame(rows = 5000, seed = 0):
+    #small frame with the walmart_data.txt schema and purchase amounts
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'User_ID': rng.integers(1000001, 1000300, rows),
+        'Product_ID': rng.choice(['P00001', 'P00002', 'P00003'], rows),
+        'Gender': rng.choice(['M', 'F'], rows, p = [0.75, 0.25]),
+        'Age': rng.choice(['0-17', '18-25', '26-35', '36-45', '46-50', '51-55', '55+'], rows),
+        'Occupation': rng.integers(0, 21, rows),
+        'City_Category': rng.choice(['A', 'B', 'C'], rows),
+        'Stay_In_Current_City_Years': rng.choice(['0', '1', '2', '3', '4+'], rows),
+        'Marital_Status': rng.integers(0, 2, rows),
+        'Product_Category': rng.integers(1, 21, rows),
+        'Purchase': rng.integers(12, 23962, rows),
+    })
+
+
+@pytest.fixture
+def sorted_csv(tmp_path):
+    #file sorted by Marital_Status, so later chunks only hold married rows
+    path = tmp_path / 'walmart_data.txt'
+    make_frame().sort_values('Marital_Status', kind = 'stable').to_csv(path, index = False)
+    return str(path)
+
+
+def test_file_moments_labels_chunks_with_one_marital_status(sorted_csv):
+    moments = w.file_moments(sorted_csv, ['Marital_Status'], chunksize = 500)['Marital_Status']
+    expected = pd.read_csv(sorted_csv).groupby('Marital_Status')['Purchase'].count()
+
+    assert sorted(moments.index) == ['Married', 'Unmarried']
+    assert moments.loc['Married', 'count'] == expected[1]
+    assert moments.loc['Unmarried', 'count'] == expected[0]
+
+
+def test_update_moments_store_keeps_two_marital_groups(sorted_csv, tmp_path):
+    store = str(tmp_path / 'moments.json')
+    w.update_moments(store, sorted_csv, ['Marital_Status'], chunksize = 500)
+    assert sorted(w.load_moments(store)['Marital_Status'].index) == ['Married', 'Unmarried']
+
+
+def test_poisson_bootstrap_labels_chunks_with_one_marital_status(sorted_csv):
+    boot = w.poisson_bootstrap(sorted_csv, ['Marital_Status'], bootstrap_samples = 50, chunksize = 500, rng = 1)
+    counts = pd.read_csv(sorted_csv)['Marital_Status'].value_counts()
+
+    assert sorted(boot.labels['Marital_Status']) == ['Married', 'Unmarried']
+    #Poisson(1) weights keep every group's expected weighted count at its row count
+    weighted = dict(zip(boot.labels['Marital_Status'], boot.counts['Marital_Status'].mean(axis = 0)))
+    assert weighted['Married'] == pytest.approx(counts[1], rel = 0.05)
+    assert weighted['Unmarried'] == pytest.approx(counts[0], rel = 0.05)
+
+
+@pytest.fixture
+def frame(tmp_path):
+    #cleaned frame as the notebook loads it
+    path = tmp_path / 'walmart_data.txt'
+    make_frame(20000).to_csv(path, index = False)
+    return w.clean_data(w.load_data(str(path)))
+
+
+def same_means(a, b):
+    return list(a) == list(b) and all(np.array_equal(a[g][k], b[g][k]) for g in a for k in a[g])
+
+
+@pytest.mark.parametrize('sizes', [[100, 2000], [None]])
+def test_bootstrap_means_do_not_depend_on_workers(frame, sizes):
+    index = w.SegmentIndex(frame, 'Age')
+    one = w.index_bootstrap(index, sizes, 2500, rng = 3, workers = 1)
+    assert same_means(one, w.index_bootstrap(index, sizes, 2500, rng = 3, workers = 4))
+
+
+@pytest.mark.parametrize('sizes', [[100, 2000], [None]])
+def test_budgeted_means_do_not_depend_on_budget_or_workers(frame, sizes):
+    index = w.SegmentIndex(frame, 'Age')
+    small = w.index_bootstrap(index, sizes, 2500, rng = 3, workers = 1, memory_budget = '4M')
+    large = w.index_bootstrap(index, sizes, 2500, rng = 3, workers = 3, memory_budget = '1G')
+    assert same_means(small, large)
+
+
+def test_plan_bootstrap_stays_within_budget(frame):
+    index = w.SegmentIndex(frame, 'Age')
+    plan = w.plan_bootstrap(index, [100, 2000, None], 5000, workers = 8, memory_budget = '4M')
+    assert plan['peak'] <= 4 * 2**20
+    with pytest.raises(MemoryError):
+        w.plan_bootstrap(index, [2000], 5000, workers = 8, memory_budget = 2**16)
+
+
+def test_cache_hit_matches_fresh_run(frame, tmp_path):
+    cache = w.BootstrapCache(str(tmp_path / 'cache'))
+    fresh = w.segment_bootstrap(frame, 'Gender', [100, None], 2000, rng = 5, cache = cache)
+    assert len(os.listdir(cache.cache_dir)) == 1
+
+    #a different seed is a different entry, an unseeded run is not cached
+    w.segment_bootstrap(frame, 'Gender', [100, None], 2000, rng = 6, cache = cache)
+    w.segment_bootstrap(frame, 'Gender', [100, None], 2000, cache = cache)
+    assert len(os.listdir(cache.cache_dir)) == 2
+
+    cached = w.segment_bootstrap(frame, 'Gender', [100, None], 2000, rng = 5, cache = cache)
+    assert same_means(fresh, cached)
+
+
+def test_cache_changes_with_data(frame, tmp_path):
+    cache = str(tmp_path / 'cache')
+    before = w.segment_bootstrap(frame, 'Gender', [100], 1000, rng = 5, cache = cache)
+    frame.loc[0, 'Purchase'] += 1
+    after = w.segment_bootstrap(frame, 'Gender', [100], 1000, rng = 5, cache = cache)
+    assert len(os.listdir(cache)) == 2
+    assert not same_means(before, after)
+
+
+def test_cache_evicts_least_recently_used(frame, tmp_path):
+    cache = w.BootstrapCache(str(tmp_path / 'cache'))
+    for seed in [1, 2, 3]:
+        w.segment_bootstrap(frame, 'Gender', [100], 1000, rng = seed, cache = cache)
+    sizes = {e.name: e.stat().st_size for e in os.scandir(cache.cache_dir)}
+
+    #reading seed 1 makes seed 2 the least recently used entry
+    w.segment_bootstrap(frame, 'Gender', [100], 1000, rng = 1, cache = cache)
+    cache.max_bytes = sum(sizes.values()) - 1
+    cache.evict()
+    left = os.listdir(cache.cache_dir)
+    assert len(left) == 2
+    assert cache.key(w.SegmentIndex(frame, 'Gender'), [100], 1000, 2) not in left
+
+
+def test_cache_skips_entries_larger_than_the_cache(frame, tmp_path):
+    cache = w.BootstrapCache(str(tmp_path / 'cache'))
+    w.segment_bootstrap(frame, 'Gender', [100], 1000, rng = 1, cache = cache)
+    kept = os.listdir(cache.cache_dir)
+
+    cache.max_bytes = os.path.getsize(os.path.join(cache.cache_dir, kept[0])) + 1
+    w.segment_bootstrap(frame, 'Gender', [100, 1000, None], 5000, rng = 2, cache = cache)
+    assert os.listdir(cache.cache_dir) == kept
+
+
+def test_cache_eviction_tolerates_files_removed_meanwhile(frame, tmp_path, monkeypatch):
+    cache = w.BootstrapCache(str(tmp_path / 'cache'), max_bytes = 1)
+    w.BootstrapCache(cache.cache_dir).put('stale.npz', [np.zeros((2, 10))])
+
+    #another process removes the file between the directory scan and the removal
+    remove = os.remove
+    def remove_twice(path):
+        remove(path)
+        remove(path)
+    monkeypatch.setattr(w.os, 'remove', remove_twice)
+    cache.evict()
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_merged_moments_match_full_groupby(frame):
+    merged = None
+    for chunk in np.array_split(np.arange(len(frame)), [1000, 1500, 12000]):
+        merged = w.merge_moments(merged, w.segment_moments(frame.iloc[chunk], 'Occupation'))
+
+    full = frame.groupby('Occupation', observed = True)['Purchase'].agg(['count', 'mean', 'var'])
+    merged = merged.loc[full.index]
+    assert np.array_equal(merged['count'], full['count'])
+    assert np.allclose(merged['mean'], full['mean'])
+    assert np.allclose(merged['m2'] / (merged['count'] - 1), full['var'])
+
+
+def test_quantile_sketch_matches_percentile(frame):
+    values = frame['Purchase'].to_numpy()
+    halves = np.array_split(values, 2)
+    sketch = w.QuantileSketch().update(halves[0]).merge(w.QuantileSketch().update(halves[1]))
+
+    q = [0, 0.01, 0.25, 0.5, 0.75, 0.99, 1]
+    assert np.allclose(sketch.quantile(q), np.percentile(values, np.multiply(q, 100)))
+    assert sketch.count == len(values)
+
+    #wider bins are off by at most one bin width
+    coarse = w.QuantileSketch(width = 50).update(values)
+    assert np.all(np.abs(coarse.quantile(q) - np.percentile(values, np.multiply(q, 100))) <= 50)
+
+
+def test_quantile_sketch_merge_matches_single_update(frame):
+    values = frame['Purchase'].to_numpy()
+    #low and high ranges first, then an empty part and the bins between them
+    ordered = np.sort(values)
+    parts = [ordered[:5000], ordered[-3000:], values[:0], ordered[5000:-3000]]
+    merged = w.QuantileSketch()
+    for part in parts:
+        merged.merge(w.QuantileSketch().update(part))
+    full = w.QuantileSketch().update(values)
+
+    assert merged.offset == full.offset
+    assert np.array_equal(merged.counts, full.counts)
+    assert np.array_equal(full.bins[full.counts > 0], np.unique(values))
+
+
+@pytest.mark.parametrize('columns', ['Gender', ['Age', 'Marital_Status'], ['Occupation', 'Gender']])
+def test_cube_rollup_matches_groupby(frame, columns):
+    rollup = w.PurchaseCube(frame).rollup(columns)
+    purchase = frame['Purchase'].astype(float)
+    full = (frame.assign(sq = purchase**2).groupby(columns, observed = True)
+            .agg(count = ('Purchase', 'count'), sum = ('Purchase', 'sum'), sum_sq = ('sq', 'sum')))
+
+    rollup = rollup.loc[full.index]
+    assert np.array_equal(rollup['count'], full['count'])
+    assert np.array_equal(rollup['sum'], full['sum'])
+    assert np.allclose(rollup['sum_sq'], full['sum_sq'])
+
+
+def test_compare_means_same_distribution_is_not_significant():
+    rng = np.random.default_rng(0)
+    values = rng.integers(12, 23962, 6000)
+    result = w.compare_means(values[:4000], values[4000:], bootstrap_samples = 2000, permutations = 2000, rng = 1)
+    assert result['p_value'] > 0.05
+
+
+def test_compare_means_different_means():
+    rng = np.random.default_rng(0)
+    a, b = rng.integers(12, 23962, 3000), rng.integers(12, 23962, 2000) - 3000
+    result = w.compare_means(a, b, [90, 95], bootstrap_samples = 2000, permutations = 2000, rng = 1)
+
+    assert result['p_value'] == 1 / (2000 + 1)
+    assert result['difference'] == pytest.approx(a.mean() - b.mean())
+    for low, high in result['intervals'].values():
+        assert low < result['difference'] < high
+    assert len(result['replicates']) == 2000
+
+
+def test_bootstrap_intervals_label_own_size_as_all(frame):
+    means = w.segment_bootstrap(frame, 'Gender', [100, None], 1000, rng = 1)
+    boot = w.bootstrap_intervals(means, [95])[95]
+    analytic = w.analytic_intervals(w.segment_stats(frame, 'Gender'), 95, [100, None])
+
+    assert list(boot.columns) == list(analytic.columns)
+    assert not boot.isna().any().any()
+
+
+def test_jackknife_acceleration_matches_leave_one_out():
+    values = np.random.default_rng(0).lognormal(8, 1, 60)
+    loo = np.array([np.delete(values, i).mean() for i in range(len(values))])
+    d = loo.mean() - loo
+    assert w.jackknife_acceleration(values) == pytest.approx((d**3).sum() / (6 * (d**2).sum()**1.5))
+
+
+def test_bca_interval_matches_scipy():
+    values = np.random.default_rng(0).lognormal(8, 1, 500)
+    means = w.bootstrap_means(values, len(values), 20000, rng = 1)
+    low, high = w.bca_interval(means, values, 95)
+
+    expected = bootstrap((values,), np.mean, confidence_level = 0.95, n_resamples = 20000,
+                         method = 'BCa', rng = np.random.default_rng(2)).confidence_interval
+    #within Monte Carlo error of the two sets of replicates, a small share of the standard error
+    se = values.std(ddof = 1) / np.sqrt(len(values))
+    assert low == pytest.approx(expected.low, abs = 0.1 * se)
+    assert high == pytest.approx(expected.high, abs = 0.1 * se)
+
+    #the skew moves both ends up from the percentile interval
+    percentile = np.percentile(means, [2.5, 97.5])
+    assert low > percentile[0] and high > percentile[1]
+
+
+@pytest.mark.parametrize('sizes', [[100, 2000], [None]])
+def test_studentized_statistics_do_not_depend_on_workers(frame, sizes):
+    index = w.SegmentIndex(frame, 'Age')
+    one = w.index_studentized(index, sizes, 2500, rng = 3, workers = 1)
+    assert same_means(one, w.index_studentized(index, sizes, 2500, rng = 3, workers = 4))
+
+
+@pytest.mark.parametrize('method, expected', [('bonferroni', [0.04, 0.16, 0.12, 0.02]),
+                                              ('holm', [0.03, 0.06, 0.06, 0.02]),
+                                              ('fdr_bh', [0.02, 0.04, 0.04, 0.02])])
+def test_adjust_p_values(method, expected):
+    assert np.allclose(w.adjust_p_values([0.01, 0.04, 0.03, 0.005], method), expected)
+    assert np.array_equal(w.adjust_p_values([0.5, 0.9], method), [1, 1] if method != 'fdr_bh' else [0.9, 0.9])
+
+
+def test_pairwise_comparisons_are_antisymmetric(frame):
+    result = w.pairwise_comparisons(frame, 'Age', [90, 95], 2000, rng = 1)
+    difference, p = result['difference'].to_numpy(), result['p_value'].to_numpy()
+
+    assert np.allclose(difference, -difference.T, equal_nan = True)
+    assert np.allclose(p, p.T, equal_nan = True)
+    for level in [90, 95]:
+        lower, upper = result['lower'][level].to_numpy(), result['upper'][level].to_numpy()
+        assert np.allclose(lower, -upper.T, equal_nan = True)
+        assert np.all(np.isnan(np.diag(lower))) and np.all(np.isnan(np.diag(p)))
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / 'walmart_data.txt'
+    make_frame().to_csv(path, index = False)
+    return str(path)
+
+
+def test_load_cached_matches_fresh_load(csv_path):
+    fresh = w.clean_data(w.load_data(csv_path))
+    pd.testing.assert_frame_equal(w.load_cached(csv_path), fresh)
+    assert os.path.exists(csv_path + '.cache/meta.json')
+    pd.testing.assert_frame_equal(w.load_cached(csv_path), fresh)
+
+    subset = w.load_cached(csv_path, columns = ['Gender', 'Purchase'])
+    assert list(subset.columns) == ['Gender', 'Purchase']
+    pd.testing.assert_frame_equal(subset, fresh[['Gender', 'Purchase']])
+
+
+def test_load_cached_keeps_cache_of_touched_file(csv_path, monkeypatch):
+    w.load_cached(csv_path)
+    st = os.stat(csv_path)
+    os.utime(csv_path, ns = (st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    #the cache is used, the parser never runs
+    def fail(*args, **kwargs):
+        raise AssertionError('cache rebuilt')
+    monkeypatch.setattr(w, 'load_data', fail)
+    w.load_cached(csv_path)
+    with open(csv_path + '.cache/meta.json') as f:
+        assert json.load(f)['mtime_ns'] == st.st_mtime_ns + 10**9
+
+
+def test_load_cached_rebuilds_after_same_size_edit(csv_path):
+    before = w.load_cached(csv_path)
+    with open(csv_path) as f:
+        text = f.read()
+    #the last digit of the last purchase amount, the file keeps its size
+    edited = text[:-2] + str((int(text[-2]) + 1) % 10) + text[-1]
+    st = os.stat(csv_path)
+    with open(csv_path, 'w') as f:
+        f.write(edited)
+    #a later modification time even where the file system's clock is coarse
+    os.utime(csv_path, ns = (st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    after = w.load_cached(csv_path)
+    assert after['Purchase'].iloc[-1] != before['Purchase'].iloc[-1]
+    pd.testing.assert_frame_equal(after, w.clean_data(w.load_data(csv_path)))
+
+
+def test_adaptive_replicates_stop_in_whole_streams(frame):
+    index = w.SegmentIndex(frame, 'Age')
+    loose = w.index_bootstrap(index, [None], 10000, rng = 3, tol = 20)
+    n = len(loose['55+'][None])
+    assert 1000 < n < 10000 and n % w.STREAM_REPLICATES == 0
+    assert all(len(loose[g][None]) == n for g in loose)
+
+    exact = w.index_bootstrap(index, [100, None], 3000, rng = 3, tol = 0)
+    assert all(len(exact[g][k]) == 3000 for g in exact for k in exact[g])
+
+
+def test_adaptive_replicates_do_not_depend_on_workers(frame):
+    index = w.SegmentIndex(frame, 'Age')
+    one = w.index_bootstrap(index, [100, None], 6000, rng = 3, workers = 1, tol = 20)
+    assert same_means(one, w.index_bootstrap(index, [100, None], 6000, rng = 3, workers = 4, tol = 20))
+
+
+def test_fused_kernel_matches_numpy_kernel(frame):
+    pytest.importorskip('numba')
+    index = w.SegmentIndex(frame, 'Age')
+    fused = w.index_bootstrap(index, [100, None], 4000, rng = 3, workers = 1, kernel = 'fused')
+    assert same_means(fused, w.index_bootstrap(index, [100, None], 4000, rng = 3, workers = 4, kernel = 'fused'))
+
+    numpy = w.index_bootstrap(index, [100, None], 4000, rng = 4)
+    for g in fused:
+        for k in fused[g]:
+            a, b = fused[g][k], numpy[g][k]
+            #means and spreads agree within about four standard errors
+            assert abs(a.mean() - b.mean()) < 4 * b.std() * np.sqrt(2 / len(b))
+            assert a.std() == pytest.approx(b.std(), rel = 4 / np.sqrt(len(b)))
+
+
+def test_stream_segments_match_groupby(csv_path):
+    streamed = w.stream_segments(csv_path, ['Age', 'Occupation'], chunksize = 700, reservoir_size = 100, rng = 1)
+    df = pd.read_csv(csv_path)
+
+    for c in ['Age', 'Occupation']:
+        full = (df.assign(sq = df['Purchase'].astype(np.int64)**2).groupby(c)
+                .agg(count = ('Purchase', 'count'), sum = ('Purchase', 'sum'), sum_sq = ('sq', 'sum')))
+        sums = streamed[c]['sums']
+        assert sorted(sums.index) == sorted(full.index)
+        assert np.array_equal(sums.loc[full.index].to_numpy(), full.to_numpy())
+
+        #every group keeps at most reservoir_size of its own values
+        for g, sample in streamed[c]['reservoir'].items():
+            assert len(sample) == min(100, full.loc[g, 'count'])
+            assert np.isin(sample, df.loc[df[c] == g, 'Purchase']).all()
+
+
+def test_executors_share_one_pool_and_limit_each_call():
+    running, peak, lock = [0], [0], threading.Lock()
+    def task(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return x * 2
+
+    two = w.get_executor(2)
+    assert [f.result() for f in [two.submit(task, x) for x in range(12)]] == list(range(0, 24, 2))
+    assert peak[0] == 2
+
+    #asking for fewer workers reuses the same pool
+    assert w.get_executor(1).executor is two.executor
+    with pytest.raises(ZeroDivisionError):
+        w.get_executor(1).submit(lambda: 1 / 0).result()
@@ -0,0 +1,1786 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Bootstrap helpers used by the Walmart confidence interval / CLT case study.
+#
+# The notebook builds CLT curves by drawing `bootstrap_samples` random samples
+# of a given size from the Purchase amounts of a segment and taking the mean
+# of every sample. The helpers below do the same thing on whole blocks of
+# replicates at once instead of one replicate per python loop iteration.
+#
+# Nothing here imports matplotlib, so the intervals can be refreshed on a
+# server without a display:
+#
+#     python walmart_ci.py walmart_data.txt Gender Marital_Status Age --out ci
+#
+# numba is optional; when it is installed kernel = 'fused' draws and sums
+# every replicate in compiled loops without holding any block of positions.
+# It is only imported the first time the fused kernel is asked for.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, t
+
+
+#maximum number of drawn values held in memory per block (~32 MB as int64)
+BLOCK_ELEMENTS = 2**22
+
+#replicates per independent random stream, fixed so that results for a given
+#seed do not depend on how many workers share the streams
+STREAM_REPLICATES = 1000
+
+#worker pool kept alive between calls, grown to the most workers asked for
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+#schema of walmart_data.txt, text columns are categorical straight from the
+#parser, integer coded columns are parsed compactly and categorized after
+STR_CATEGORIES = ['Product_ID', 'Gender', 'Age', 'City_Category', 'Stay_In_Current_City_Years']
+INT_CATEGORIES = {'User_ID': 'int32', 'Occupation': 'int8', 'Marital_Status': 'int8', 'Product_Category': 'int8'}
+PURCHASE_DTYPE = 'int32'
+
+#labels used for the 0 / 1 codes of Marital_Status
+MARITAL_STATUS = {0: 'Unmarried', 1: 'Married'}
+
+#columns summarised by the streaming pass
+SEGMENT_COLUMNS = ['Gender', 'Age', 'Occupation', 'City_Category', 'Stay_In_Current_City_Years',
+                   'Marital_Status', 'Product_Category']
+
+#customer columns crossed by the purchase cube
+CUBE_COLUMNS = ['Gender', 'Age', 'Marital_Status', 'City_Category', 'Stay_In_Current_City_Years', 'Occupation']
+
+
+def _as_array(data):
+    #accepts a pandas Series / list / array and returns a plain numpy array
+    return np.asarray(getattr(data, 'values', data))
+
+
+def load_data(path, usecols = None, engine = 'c'):
+    """Read walmart_data.txt with the column types applied while parsing.
+
+    Purchase is read as int32 and every other column ends up categorical,
+    the same result as the notebook's astype('category') loop without a
+    second copy of the frame. `usecols` limits the columns read, and
+    engine = 'pyarrow' uses the multithreaded parser when pyarrow is
+    installed.
+    """
+    df = pd.read_csv(path, usecols = usecols, dtype = _dtypes(usecols), engine = engine)
+    return _categorize(df)
+
+
+def _dtypes(usecols = None):
+    #parser dtypes of the columns read
+    dtype = {c: 'category' for c in STR_CATEGORIES}
+    dtype.update(INT_CATEGORIES)
+    dtype['Purchase'] = PURCHASE_DTYPE
+    if usecols is not None:
+        dtype = {c: d for c, d in dtype.items() if c in usecols}
+    return dtype
+
+
+def _categorize(df):
+    #integer coded columns become categorical after parsing
+    for c in INT_CATEGORIES:
+        if c in df:
+            df[c] = df[c].astype('category')
+    return df
+
+
+def clean_data(df):
+    #same cleaning as the notebook: readable marital status labels, also for
+    #chunks holding only one of the codes (labels already readable are kept)
+    if 'Marital_Status' in df:
+        df['Marital_Status'] = df['Marital_Status'].cat.rename_categories(lambda c: MARITAL_STATUS.get(c, c))
+    return df
+
+
+def file_hash(path, chunk = 2**20):
+    #blake2b digest of the file contents
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _save_frame(df, cache_dir, meta):
+    #one .npy file per column, codes and categories for categorical columns
+    os.makedirs(cache_dir, exist_ok = True)
+    meta['columns'] = {}
+    for c in df:
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            cats = df[c].cat.categories
+            np.save(os.path.join(cache_dir, f'{c}.npy'), df[c].cat.codes.values)
+            np.save(os.path.join(cache_dir, f'{c}.categories.npy'),
+                    cats.values.astype(str) if cats.dtype == object else cats.values)
+            meta['columns'][c] = 'category'
+        else:
+            np.save(os.path.join(cache_dir, f'{c}.npy'), df[c].values)
+            meta['columns'][c] = str(df[c].dtype)
+
+    #the metadata is written last, so a half written cache is never used
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def _load_frame(cache_dir, columns):
+    data = {}
+    for c in columns:
+        values = np.load(os.path.join(cache_dir, f'{c}.npy'))
+        if columns[c] == 'category':
+            cats = np.load(os.path.join(cache_dir, f'{c}.categories.npy'))
+            values = pd.Categorical.from_codes(values, cats)
+        data[c] = values
+    return pd.DataFrame(data)
+
+
+def load_cached(path, cache_dir = None, columns = None, engine = 'c'):
+    """Load the cleaned, categorized frame of `path` from an on disk cache.
+
+    The cache is a directory of .npy files, one per column (category codes
+    and categories for categorical columns), next to `path` by default. It
+    is keyed by the size, modification time and content hash of the source
+    file and rebuilt with `load_data()` + `clean_data()` when the file
+    changes. A file that was only touched keeps its cache once the content
+    hash matches. `columns` loads only some of the cached columns.
+    """
+    cache_dir = cache_dir or f'{path}.cache'
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    st = os.stat(path)
+    key = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    if meta is not None and meta['size'] == key['size'] and meta['mtime_ns'] != key['mtime_ns']:
+        #same size but touched, only the content hash can tell
+        if meta['hash'] == file_hash(path):
+            meta.update(key)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        else:
+            meta = None
+
+    if meta is None or meta['size'] != key['size'] or meta['mtime_ns'] != key['mtime_ns']:
+        df = clean_data(load_data(path, engine = engine))
+        meta = dict(key, hash = file_hash(path))
+        _save_frame(df, cache_dir, meta)
+        return df if columns is None else df[list(columns)]
+
+    cached = meta['columns']
+    return _load_frame(cache_dir, cached if columns is None else {c: cached[c] for c in columns})
+
+
+def bootstrap_means(data, sample_size, bootstrap_samples = 20000, rng = None, method = 'choice'):
+    """Return the means of `bootstrap_samples` random samples (with
+    replacement) of size `sample_size` drawn from `data`.
+
+    With method = 'choice' replicates are drawn as (b, sample_size) blocks of
+    row positions. With method = 'fused' (needs numba) every replicate is
+    summed while its positions are drawn, using memory for the means only.
+
+    The result is a numpy array of length `bootstrap_samples`, which can be
+    stored in the `*_samples` dicts and passed to `confidence_interval()`
+    like the old python lists.
+    """
+    rng = np.random.default_rng(rng)
+    values = _as_array(data)
+
+    if method == 'fused':
+        return _fused_stream(values, np.zeros(1, np.int64), np.array([len(values)]), sample_size,
+                             bootstrap_samples, rng.integers(2**32))[0]
+    if method != 'choice':
+        raise ValueError(f"unknown bootstrap method {method!r}")
+
+    #number of replicates per block, at least one replicate at a time
+    block = max(1, BLOCK_ELEMENTS // sample_size)
+
+    means = np.empty(bootstrap_samples)
+    for start in range(0, bootstrap_samples, block):
+        stop = min(start + block, bootstrap_samples)
+
+        #drawing the random positions for the whole block of replicates
+        #(multinomial counts over the distinct values were measured slower)
+        idx = rng.integers(0, len(values), size = (stop - start, sample_size))
+        means[start:stop] = values[idx].mean(axis = 1)
+
+    return means
+
+
+def segment_codes(df, column):
+    #category codes and group labels of a column, converting it if needed
+    col = df[column] if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column].astype('category')
+    return col.cat.codes.values, col.cat.categories
+
+
+class SegmentIndex:
+    """Rows of a frame grouped by the category codes of one or more columns.
+
+    The value column is stable sorted by the combined code of `columns` once,
+    so the rows of every group (or combination of groups, one label per
+    column) are a contiguous slice: `index['M']` or `index['M', '26-35']`
+    returns a view of their purchase amounts without a boolean mask or a
+    copy. Rows with a missing label in any of the columns are left out.
+    """
+
+    def __init__(self, df, columns, value = 'Purchase'):
+        self.columns = [columns] if isinstance(columns, str) else list(columns)
+        codes, self.categories = zip(*[segment_codes(df, c) for c in self.columns])
+        self.shape = tuple(len(c) for c in self.categories)
+
+        #combined code of every row with all the labels present
+        valid = np.logical_and.reduce([c >= 0 for c in codes])
+        key = np.ravel_multi_index(tuple(c[valid] for c in codes), self.shape)
+
+        order = np.argsort(key, kind = 'stable')
+
+        #positions in df of the sorted rows, and their values
+        self.rows = np.flatnonzero(valid)[order]
+        self.values = _as_array(df[value])[self.rows]
+
+        #size and start of every cell in the sorted values
+        self.counts = np.bincount(key, minlength = int(np.prod(self.shape)))
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def cell(self, labels):
+        #flat cell number of one label per column
+        labels = labels if isinstance(labels, tuple) else (labels,)
+        return int(np.ravel_multi_index(tuple(c.get_loc(l) for c, l in zip(self.categories, labels)), self.shape))
+
+    def label(self, cell):
+        #labels of a flat cell number, a plain label for a single column
+        labels = tuple(c[i] for c, i in zip(self.categories, np.unravel_index(cell, self.shape)))
+        return labels[0] if len(labels) == 1 else labels
+
+    def cells(self):
+        #flat cell numbers of the non empty cells
+        return np.flatnonzero(self.counts)
+
+    def groups(self):
+        return [self.label(k) for k in self.cells()]
+
+    def fingerprint(self):
+        #blake2b digest of the grouping and the grouped values, the same for the same data
+        digest = hashlib.blake2b()
+        digest.update(json.dumps([self.columns, [list(map(str, c)) for c in self.categories]]).encode())
+        for a in [self.counts, self.values]:
+            digest.update(str(a.dtype).encode())
+            digest.update(np.ascontiguousarray(a).tobytes())
+        return digest.hexdigest()
+
+    def __getitem__(self, labels):
+        k = self.cell(labels)
+        return self.values[self.starts[k]:self.starts[k] + self.counts[k]]
+
+
+class _WorkerLimit:
+    """Submits to a shared pool with at most `workers` of its own calls
+    running at a time; the rest wait in order and start as earlier ones
+    finish, so submitting never blocks."""
+
+    def __init__(self, executor, workers):
+        self.executor = executor
+        self.free = workers
+        self.waiting = deque()
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        future = Future()
+        with self.lock:
+            self.waiting.append((future, fn, args))
+        self._start()
+        return future
+
+    def _start(self):
+        while True:
+            with self.lock:
+                if not self.free or not self.waiting:
+                    return
+                self.free -= 1
+                future, fn, args = self.waiting.popleft()
+            self.executor.submit(fn, *args).add_done_callback(partial(self._done, future))
+
+    def _done(self, future, inner):
+        #hands the result over and lets the next waiting call start
+        if inner.exception() is None:
+            future.set_result(inner.result())
+        else:
+            future.set_exception(inner.exception())
+        with self.lock:
+            self.free += 1
+        self._start()
+
+
+def get_executor(workers = None):
+    """Return an executor running at most `workers` calls at a time (all
+    cores by default) on one thread pool shared by every call.
+
+    The pool is created once with all cores, and replaced by a larger one
+    only when more workers than that are asked for, so alternating worker
+    counts do not keep one idle pool per count.
+
+    Threads are enough here because numpy releases the GIL while drawing
+    random numbers, gathering values and reducing the means.
+    """
+    global _executor, _executor_workers
+    workers = workers or os.cpu_count() or 1
+    with _executor_lock:
+        if _executor is None or _executor_workers < workers:
+            #a replaced pool finishes the calls given to it, its threads exit once it is unused
+            _executor_workers = max(workers, os.cpu_count() or 1)
+            _executor = ThreadPoolExecutor(max_workers = _executor_workers, thread_name_prefix = 'walmart_ci')
+        return _WorkerLimit(_executor, workers)
+
+
+def _seed_sequence(rng):
+    #root seed sequence from a seed, None, a SeedSequence or an existing Generator
+    if isinstance(rng, np.random.SeedSequence):
+        return rng
+    if isinstance(rng, np.random.Generator):
+        return np.random.SeedSequence(rng.integers(2**63))
+    return np.random.SeedSequence(rng)
+
+
+def _segment_stream(values, starts, counts, size, replicates, seed, block_elements = BLOCK_ELEMENTS, compact = False):
+    #means of `replicates` bootstrap samples of every group from one random stream
+    rng = np.random.default_rng(seed)
+    means = np.empty((len(starts), replicates))
+    if compact:
+        #int32 positions drawn cell by cell, replicate by replicate, the same for any block size
+        return _compact_stream(values, starts, counts, size, seed, means, block_elements)
+
+    if size is None:
+        #every group resampled at its own size: one draw per sorted row, summed per group
+        row_start, row_count = np.repeat(starts, counts), np.repeat(counts, counts)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        block = max(1, block_elements // len(row_start))
+    else:
+        starts, counts = starts[:, None, None], counts[:, None, None]
+        block = max(1, block_elements // (size * len(starts)))
+
+    #number of replicates per block is at least one replicate at a time
+    for start in range(0, replicates, block):
+        stop = min(start + block, replicates)
+
+        if size is None:
+            idx = row_start + (rng.random((stop - start, len(row_start))) * row_count).astype(np.int64)
+            sums = np.add.reduceat(values[idx], offsets, axis = 1, dtype = np.float64)
+            means[:, start:stop] = (sums / counts).T
+        else:
+            #random positions inside every group for the whole block of replicates
+            idx = starts + (rng.random((len(starts), stop - start, size)) * counts).astype(np.int64)
+            means[:, start:stop] = values[idx].mean(axis = 2)
+
+    return means
+
+
+def _compact_stream(values, starts, counts, size, seed, means, block_elements):
+    #_segment_stream with int32 positions drawn cell by cell, about half the bytes per drawn position
+    #every cell has its own child generator, so each draw has one scalar bound
+    for k, ss in enumerate(_seed_sequence(seed).spawn(len(starts))):
+        rng = np.random.default_rng(ss)
+        cell = values[starts[k]:starts[k] + counts[k]]
+        #own size draws as many positions as the cell has rows
+        n = counts[k] if size is None else size
+        block = max(1, block_elements // n)
+
+        for start in range(0, means.shape[1], block):
+            stop = min(start + block, means.shape[1])
+            means[k, start:stop] = cell[rng.integers(0, counts[k], size = (stop - start, n), dtype = np.int32)].mean(axis = 1)
+
+    return means
+
+#compiled fused kernel, built by _fused_kernel() on first use
+_fused = None
+
+
+def _fused_kernel():
+    #imports numba and compiles the kernel the first time the fused kernel is asked for
+    global _fused
+    if _fused is None:
+        try:
+            from numba import njit
+        except ImportError:
+            raise ImportError("kernel = 'fused' needs numba") from None
+
+        @njit(nogil = True)
+        def fused(values, starts, counts, sizes, replicates, seed):
+            #one running sum per replicate, the random positions are never stored
+            np.random.seed(seed)
+            means = np.empty((len(starts), replicates))
+            for g in range(len(starts)):
+                for r in range(replicates):
+                    total = 0.0
+                    for j in range(sizes[g]):
+                        total += values[starts[g] + int(np.random.random() * counts[g])]
+                    means[g, r] = total / sizes[g]
+            return means
+
+        _fused = fused
+    return _fused
+
+
+def _fused_stream(values, starts, counts, size, replicates, seed):
+    #same contract as _segment_stream, with compiled draw-and-sum loops
+    if isinstance(seed, np.random.SeedSequence):
+        seed = seed.generate_state(1)[0]
+    sizes = counts if size is None else np.full(len(counts), size)
+    return _fused_kernel()(values, starts.astype(np.int64), counts.astype(np.int64), sizes.astype(np.int64),
+                         replicates, seed)
+
+
+#stream functions by kernel name
+KERNELS = {'numpy': _segment_stream, 'fused': _fused_stream}
+
+
+def _kernel(kernel):
+    #stream function of a kernel name, checking for numba before any work is queued
+    if kernel not in KERNELS:
+        raise ValueError(f"unknown kernel {kernel!r}")
+    if kernel == 'fused':
+        _fused_kernel()
+    return KERNELS[kernel]
+
+
+def parse_bytes(size):
+    #bytes of a memory size such as 2G, 512M or 1500000
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([KMGT]?)i?B?\s*', str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"invalid memory size {size!r}")
+    return int(float(match[1]) * 1024 ** ' KMGT'.index(match[2].upper() or ' '))
+
+
+def plan_bootstrap(index, sample_sizes, bootstrap_samples = 20000, workers = None, memory_budget = None,
+                   kernel = 'numpy', statistic = 'mean'):
+    """Plan the working memory of an `index_bootstrap()` run, or of an
+    `index_studentized()` run with statistic = 't'.
+
+    Without a budget the plan is the default one: blocks of BLOCK_ELEMENTS
+    positions on `workers` threads. With `memory_budget` (bytes, or a size
+    such as '2G', see `parse_bytes()`) positions are drawn as int32 and the
+    block size, and if needed the number of workers, are chosen so that the
+    planned peak stays within it. MemoryError is raised when not even one
+    replicate per worker fits.
+
+    The peak counts the blocks of positions and gathered values of every
+    worker, the per row arrays of own size resampling and the bootstrap
+    means themselves (kept in float64, they are small next to the blocks);
+    the frame and the `SegmentIndex` already in memory are not included.
+
+    Returns {'workers', 'block_elements', 'compact', 'peak'}.
+    """
+    present = index.cells()
+    cells, rows = len(present), int(index.counts[present].sum())
+    workers = workers or os.cpu_count() or 1
+    compact = memory_budget is not None or statistic == 't'
+    budget = None if memory_budget is None else parse_bytes(memory_budget)
+
+    #bytes held per drawn position: the positions and their temporaries (float64
+    #draws and int64 positions, or int32 positions), plus the gathered values and
+    #the float64 sums of own size resampling
+    draw = 0 if kernel == 'fused' else 4 if compact else 16
+    item = index.values.itemsize
+    per_element = {size: draw and draw + item + (8 if size is None and not compact else item) for size in sample_sizes}
+    if statistic == 't':
+        #int32 positions are dropped once gathered, then the float64 deviations
+        per_element = {size: item + 8 for size in sample_sizes}
+    #row start and count of every row when groups are resampled at their own size
+    per_row = 16 if None in sample_sizes and kernel != 'fused' and not compact else 0
+
+    #positions in one replicate of a sample size, the smallest possible block,
+    #int32 positions are drawn one cell at a time
+    if compact:
+        widths = {size: int(index.counts[present].max()) if size is None else size for size in sample_sizes}
+    else:
+        widths = {size: rows if size is None else cells * size for size in sample_sizes}
+
+    #the streams of all sample sizes are queued together, workers beyond them sit idle
+    streams = len(sample_sizes) * _stream_count(bootstrap_samples)
+
+    def peak(workers, block):
+        #largest block actually drawn for any sample size, a stream holds at most STREAM_REPLICATES
+        if compact:
+            #a cell of any width draws whole replicates up to the block, but at least one
+            drawn = max(per_element[size] * min(max(block, w), STREAM_REPLICATES * w) for size, w in widths.items())
+        else:
+            drawn = max(per_element[size] * min(max(1, block // w), STREAM_REPLICATES) * w for size, w in widths.items())
+        stream = drawn + per_row * rows + cells * STREAM_REPLICATES * 8
+        return min(workers, streams) * stream + cells * bootstrap_samples * 8 * (len(sample_sizes) + 1)
+
+    block = BLOCK_ELEMENTS
+    if budget is not None and draw:
+        #positions per block are shared by all sample sizes, sized for the costliest one
+        element, width = max(per_element.values()), max(widths.values())
+        workers = min(workers, streams)
+        while True:
+            fixed = peak(workers, 0) - workers * max(per_element[k] * w for k, w in widths.items())
+            block = (budget - fixed) // (workers * element)
+            if block >= width or workers == 1:
+                break
+            workers -= 1
+        block = min(block, STREAM_REPLICATES * width)
+
+    planned = peak(workers, max(block, 0))
+    if budget is not None and planned > budget:
+        raise MemoryError(f"bootstrap needs at least {planned / 2**20:.0f} MB, budget is {budget / 2**20:.0f} MB")
+    return {'workers': workers, 'block_elements': int(block), 'compact': compact, 'peak': int(planned)}
+
+
+def _stream_count(bootstrap_samples):
+    return -(-bootstrap_samples // STREAM_REPLICATES)
+
+
+def _submit_streams(stream, args, bootstrap_samples, seeds, executor):
+    #queues stream(*args, replicates, seed) for every chunk of replicates, without waiting
+    bounds = list(range(0, bootstrap_samples, STREAM_REPLICATES)) + [bootstrap_samples]
+    return [executor.submit(stream, *args, stop - start, seed)
+            for seed, start, stop in zip(seeds, bounds[:-1], bounds[1:])]
+
+
+def _join_streams(futures):
+    #means of the chunks of replicates, joined by replicate
+    return np.concatenate([f.result() for f in futures], axis = 1)
+
+
+def _run_streams(stream, args, bootstrap_samples, seeds, workers):
+    #runs stream(*args, replicates, seed) for every chunk of replicates on the pool, joined by replicate
+    return _join_streams(_submit_streams(stream, args, bootstrap_samples, seeds, get_executor(workers)))
+
+
+class BootstrapCache:
+    """On disk cache of `index_bootstrap()` results, bounded to `max_bytes`.
+
+    Every run is one compressed .npz file of its (cells, replicates) means
+    per sample size, named after a hash of everything that decides them:
+    the `SegmentIndex.fingerprint()` of the data, the sample sizes, the
+    number of replicates, the seed, the kernel, the block layout and the
+    stopping rule of adaptive runs. Only runs with an integer seed are
+    cached, other runs are not reproducible.
+
+    Reading a file marks it as used (its modification time), and every
+    write evicts the least recently used files until the directory fits
+    in `max_bytes` again.
+    """
+
+    def __init__(self, cache_dir, max_bytes = 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, index, sample_sizes, bootstrap_samples, seed, kernel = 'numpy', compact = False, adaptive = None):
+        #file name of a run, None when the run is not reproducible; adaptive is (tol, levels, min_samples)
+        if not isinstance(seed, (int, np.integer)):
+            return None
+        key = [index.fingerprint(), list(sample_sizes), bootstrap_samples, int(seed), kernel, compact,
+               STREAM_REPLICATES, None if compact else BLOCK_ELEMENTS, adaptive and list(adaptive)]
+        return hashlib.blake2b(json.dumps(key).encode(), digest_size = 20).hexdigest() + '.npz'
+
+    def get(self, name, index, sample_sizes):
+        #{group: {sample_size: means}} of a cached run, None when missing or unreadable
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with np.load(path) as f:
+                means = [f[f'means{k}'] for k in range(len(sample_sizes))]
+            os.utime(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        return _means_by_group(index, sample_sizes, means)
+
+    def put(self, name, means):
+        #means is the list of (cells, replicates) arrays of the sample sizes
+        #writes through a temporary file, so a reader never sees half a file; an entry
+        #larger than the whole cache is not kept, it would only evict everything else
+        os.makedirs(self.cache_dir, exist_ok = True)
+        path = os.path.join(self.cache_dir, name)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, **{f'means{k}': m for k, m in enumerate(means)})
+        if os.path.getsize(tmp) > self.max_bytes:
+            os.remove(tmp)
+            return
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        #least recently used files first, until the cache fits in max_bytes
+        #another process sharing the directory may remove the same files meanwhile
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir) if os.path.isdir(self.cache_dir) else []:
+            if entry.name.endswith('.npz'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def _means_by_group(index, sample_sizes, means):
+    #{group: {sample_size: means}} from one (cells, replicates) array per sample size
+    result = {index.label(k): {} for k in index.cells()}
+    for size, m in zip(sample_sizes, means):
+        for g, row in zip(result, m):
+            result[g][size] = row
+    return result
+
+
+def index_bootstrap(index, sample_sizes, bootstrap_samples = 20000, rng = None, workers = None, kernel = 'numpy',
+                    memory_budget = None, cache = None, tol = None, levels = (95,), min_samples = 1000):
+    """Bootstrap the mean of every non empty cell of a `SegmentIndex`.
+
+    Every block of replicates draws positions for all cells in one
+    (cells, b, n) array, so adding groups or segment columns does not add
+    another resampling loop. A sample size of None resamples every cell at
+    its own size, drawing one position per row and summing the draws per
+    cell with a grouped reduction.
+
+    Replicates are split into streams of STREAM_REPLICATES, each with its
+    own seed spawned from `rng`, and the streams of all sample sizes run
+    together on the shared thread pool, at most `workers` at a time (see
+    `get_executor()`). The same seed gives the same means for any number
+    of workers.
+
+    kernel = 'numpy' draws blocks of up to BLOCK_ELEMENTS positions per
+    stream. kernel = 'fused' (needs numba) draws and sums one position at a
+    time in compiled code, so a stream only holds its (cells, replicates)
+    means; it uses a different random generator, so its means differ from
+    the numpy kernel's for the same seed.
+
+    With a `memory_budget` the block size, position dtype and number of
+    workers come from `plan_bootstrap()`. Budgeted runs draw int32
+    positions cell by cell (one child generator per cell) and replicate by
+    replicate, so their means are the same for any budget or number of
+    workers, but differ from unbudgeted ones.
+
+    With `tol` (in dollars) the number of replicates is adaptive: every
+    sample size starts with `min_samples` and gets batches of
+    STREAM_REPLICATES more until the `endpoint_error()` of every interval
+    endpoint at `levels` of every cell is at most `tol`, with
+    `bootstrap_samples` as the upper limit.
+
+    `cache` (a `BootstrapCache` or a directory for one) returns the means
+    of an earlier run with the same data, parameters and integer seed
+    without resampling, and stores the means of new runs.
+
+    Returns {group: {sample_size: array of means}}, bootstrap_samples
+    means per sample size unless `tol` stopped it earlier.
+    """
+    stream = _kernel(kernel)
+    if memory_budget is not None:
+        plan = plan_bootstrap(index, sample_sizes, bootstrap_samples, workers, memory_budget, kernel)
+        workers = plan['workers']
+        if kernel == 'numpy':
+            stream = partial(stream, block_elements = plan['block_elements'], compact = True)
+
+    name = None
+    if cache is not None:
+        cache = cache if isinstance(cache, BootstrapCache) else BootstrapCache(cache)
+        adaptive = None if tol is None else (tol, list(levels), min_samples)
+        name = cache.key(index, sample_sizes, bootstrap_samples, rng, kernel, memory_budget is not None, adaptive)
+        cached = name and cache.get(name, index, sample_sizes)
+        if cached:
+            return cached
+
+    present = index.cells()
+    args = [(index.values, index.starts[present], index.counts[present], size) for size in sample_sizes]
+    executor = get_executor(workers)
+
+    if tol is None:
+        #one independent stream per chunk of replicates and sample size, all queued at once
+        #so that short runs do not leave workers idle
+        streams = _stream_count(bootstrap_samples)
+        seeds = _seed_sequence(rng).spawn(len(sample_sizes) * streams)
+        pending = [_submit_streams(stream, args[k], bootstrap_samples, seeds[k * streams:(k + 1) * streams], executor)
+                   for k in range(len(sample_sizes))]
+        means = []
+        for k in range(len(sample_sizes)):
+            means.append(_join_streams(pending[k]))
+            pending[k] = None
+    else:
+        #every sample size gets its own root seed, every batch a child of it; each round
+        #queues the next batch of every sample size that has not converged yet
+        roots = _seed_sequence(rng).spawn(len(sample_sizes))
+        means = [np.empty((len(present), 0)) for _ in sample_sizes]
+        steps = {k: min(min_samples, bootstrap_samples) for k in range(len(sample_sizes))}
+        while steps:
+            pending = {k: _submit_streams(stream, args[k], step, roots[k].spawn(_stream_count(step)), executor)
+                       for k, step in steps.items()}
+            for k, futures in pending.items():
+                means[k] = np.concatenate([means[k], _join_streams(futures)], axis = 1)
+
+                #largest error over cells, levels and both endpoints
+                error = max(e.max() for m in means[k] for e in endpoint_error(m, levels).values())
+                if error <= tol or means[k].shape[1] >= bootstrap_samples:
+                    del steps[k]
+                else:
+                    steps[k] = min(STREAM_REPLICATES, bootstrap_samples - means[k].shape[1])
+
+    if name:
+        cache.put(name, means)
+    return _means_by_group(index, sample_sizes, means)
+
+
+def segment_bootstrap(df, column, sample_sizes, bootstrap_samples = 20000, value = 'Purchase', rng = None,
+                      workers = None, kernel = 'numpy', memory_budget = None, cache = None, tol = None,
+                      levels = (95,), min_samples = 1000):
+    """Bootstrap the mean of `value` for every group of a categorical column
+    (see `index_bootstrap()`). Groups with no rows are skipped.
+
+    Returns {group: {sample_size: array of bootstrap_samples means}}.
+    """
+    return index_bootstrap(SegmentIndex(df, column, value), sample_sizes, bootstrap_samples, rng, workers, kernel,
+                           memory_budget, cache, tol, levels, min_samples)
+
+
+def confidence_interval(data, ci, method = 'percentile', values = None, sample_size = None):
+    """Percentile interval of a bootstrap distribution, same as the
+    notebook's `confidence_interval()`.
+
+    method = 'bca' gives the `bca_interval()` of bootstrap means of the
+    mean of `values`, method = 'studentized' the `t_interval()` of the t
+    statistics of `studentized_bootstrap()`; both need `values`, and the
+    `sample_size` the replicates were drawn at (all values by default).
+    """
+    if method == 'bca':
+        return bca_interval(data, values, ci, sample_size)
+    if method == 'studentized':
+        return t_interval(data, values, ci, sample_size)
+    if method != 'percentile':
+        raise ValueError(f"unknown interval method {method!r}")
+    l_ci = (100 - ci) / 2
+    u_ci = (100 + ci) / 2
+    return np.percentile(data, [l_ci, u_ci]).round(0)
+
+
+def confidence_intervals(data, levels):
+    """Percentile intervals of a bootstrap distribution for several
+    confidence levels, read with a single percentile call.
+
+    Returns {level: array([lower, upper])}.
+    """
+    q = np.concatenate([[(100 - ci) / 2, (100 + ci) / 2] for ci in levels])
+    limits = np.percentile(data, q).round(0)
+    return {ci: limits[2 * k:2 * k + 2] for k, ci in enumerate(levels)}
+
+
+def jackknife_acceleration(values, sample_size = None):
+    """Jackknife acceleration of the mean for BCa intervals, in O(n).
+
+    The leave-one-out means are (sum - x_i) / (n - 1), so their deviations
+    from the full mean are (x_i - mean) / (n - 1) and the usual
+    sum(d^3) / (6 sum(d^2)^1.5) reduces to the third and second central
+    moments of the values. For a bootstrap of `sample_size` draws the
+    acceleration of the full sample is rescaled by sqrt(n / sample_size).
+    """
+    values = _as_array(values).astype(float)
+    d = values - values.mean()
+    a = (d**3).sum() / (6 * (d**2).sum()**1.5)
+    if sample_size is not None:
+        a *= np.sqrt(len(values) / sample_size)
+    return a
+
+
+def bca_interval(means, values, ci, sample_size = None):
+    """Bias corrected and accelerated interval of a bootstrap distribution
+    of the mean of `values` (at `sample_size` draws, all values by default).
+    """
+    means = np.asarray(means)
+    theta = _as_array(values).mean()
+
+    #bias correction from the share of replicates below the observed mean
+    z0 = norm.ppf((np.count_nonzero(means < theta) + 0.5 * np.count_nonzero(means == theta)) / len(means))
+    a = jackknife_acceleration(values, sample_size)
+
+    z = norm.ppf([(100 - ci) / 200, (100 + ci) / 200])
+    q = norm.cdf(z0 + (z0 + z) / (1 - a * (z0 + z)))
+    return np.percentile(means, 100 * q).round(0)
+
+
+def _studentized_stream(values, starts, counts, theta, size, replicates, seed, block_elements = BLOCK_ELEMENTS):
+    #t statistics of `replicates` bootstrap samples of every group, int32 positions drawn
+    #cell by cell from a child generator per cell, replicate by replicate
+    stats = np.empty((len(starts), replicates))
+
+    for k, ss in enumerate(_seed_sequence(seed).spawn(len(starts))):
+        rng = np.random.default_rng(ss)
+        cell = values[starts[k]:starts[k] + counts[k]]
+        n = counts[k] if size is None else size
+        block = max(1, block_elements // n)
+
+        for start in range(0, replicates, block):
+            stop = min(start + block, replicates)
+            draws = cell[rng.integers(0, counts[k], size = (stop - start, n), dtype = np.int32)]
+            se = np.sqrt(draws.var(axis = 1, ddof = 1) / n)
+            stats[k, start:stop] = (draws.mean(axis = 1) - theta[k]) / np.where(se > 0, se, np.inf)
+
+    return stats
+
+
+def index_studentized(index, sample_sizes, bootstrap_samples = 20000, rng = None, workers = None,
+                      memory_budget = None):
+    """t statistics (mean* - mean) / (sd* / sqrt(n)) of every non empty cell
+    of a `SegmentIndex`, for bootstrap-t intervals.
+
+    Resampled in streams on the worker pool like `index_bootstrap()`, with
+    blocks of at most BLOCK_ELEMENTS positions, or sized by
+    `plan_bootstrap()` for a `memory_budget`. Positions are drawn as int32
+    cell by cell and replicate by replicate, so a seed gives the same
+    statistics for any budget or number of workers.
+
+    Returns {group: {sample_size: array of bootstrap_samples t statistics}}.
+    """
+    present = index.cells()
+    starts, counts = index.starts[present], index.counts[present]
+    theta = np.add.reduceat(index.values, starts, dtype = np.float64) / counts
+
+    stream = _studentized_stream
+    if memory_budget is not None:
+        plan = plan_bootstrap(index, sample_sizes, bootstrap_samples, workers, memory_budget, statistic = 't')
+        workers = plan['workers']
+        stream = partial(stream, block_elements = plan['block_elements'])
+
+    streams = _stream_count(bootstrap_samples)
+    seeds = _seed_sequence(rng).spawn(len(sample_sizes) * streams)
+    executor = get_executor(workers)
+    pending = [_submit_streams(stream, (index.values, starts, counts, theta, size), bootstrap_samples,
+                               seeds[k * streams:(k + 1) * streams], executor)
+               for k, size in enumerate(sample_sizes)]
+    return _means_by_group(index, sample_sizes, [_join_streams(futures) for futures in pending])
+
+
+def studentized_bootstrap(values, sample_size, bootstrap_samples = 20000, rng = None, workers = None):
+    """t statistics (mean* - mean) / (sd* / sqrt(n)) of `bootstrap_samples`
+    random samples of size `sample_size` (see `index_studentized()`)."""
+    values = _as_array(values)
+    starts, counts = np.zeros(1, np.int64), np.array([len(values)])
+    seeds = _seed_sequence(rng).spawn(_stream_count(bootstrap_samples))
+    return _run_streams(_studentized_stream, (values, starts, counts, values.mean(), sample_size),
+                        bootstrap_samples, seeds, workers)[0]
+
+
+def t_interval(stats, values, ci, sample_size = None):
+    #bootstrap-t interval from the t statistics of the mean of `sample_size` draws from `values`
+    values = _as_array(values).astype(float)
+    se = values.std(ddof = 1) / np.sqrt(sample_size or len(values))
+    t_low, t_high = np.percentile(stats, [(100 - ci) / 2, (100 + ci) / 2])
+    return np.array([values.mean() - t_high * se, values.mean() - t_low * se]).round(0)
+
+
+def studentized_interval(values, ci, sample_size = None, bootstrap_samples = 20000, rng = None, workers = None):
+    """Bootstrap-t interval of the mean of `sample_size` draws from `values`
+    (all values by default)."""
+    values = _as_array(values)
+    sample_size = sample_size or len(values)
+    stats = studentized_bootstrap(values, sample_size, bootstrap_samples, rng, workers)
+    return t_interval(stats, values, ci, sample_size)
+
+
+def endpoint_error(data, levels):
+    """Monte Carlo error of the percentile interval endpoints of a bootstrap
+    distribution, as the half width of an approximate 95% band.
+
+    Uses the asymptotic variance of a sample quantile, p (1 - p) / (B f^2),
+    with the density f at the quantile estimated from the spacing of nearby
+    order statistics. Returns {level: array([lower error, upper error])}.
+    """
+    data = np.asarray(data)
+    b = len(data)
+    h = min(0.5 * b**(-1 / 3), 0.01)
+    errors = {}
+    for ci in levels:
+        p = np.array([(100 - ci) / 200, (100 + ci) / 200])
+        spacing = np.quantile(data, np.minimum(p + h, 1)) - np.quantile(data, np.maximum(p - h, 0))
+        errors[ci] = 1.96 * np.sqrt(p * (1 - p) / b) * spacing / (2 * h)
+    return errors
+
+
+def adaptive_bootstrap(df, column, sample_sizes, levels = (95,), tol = 1.0, min_samples = 1000,
+                       max_samples = 20000, value = 'Purchase', rng = None, workers = None, **options):
+    """Like `segment_bootstrap()`, but instead of a fixed number of
+    replicates keeps drawing batches of STREAM_REPLICATES for every sample
+    size until the `endpoint_error()` of every interval endpoint of every
+    group is at most `tol` (in dollars), or `max_samples` is reached.
+    `options` (kernel, memory_budget, cache) are passed on.
+
+    Returns {group: {sample_size: array of means}}; the arrays of a sample
+    size have as many replicates as it needed.
+    """
+    return segment_bootstrap(df, column, sample_sizes, max_samples, value, rng, workers, tol = tol, levels = levels,
+                             min_samples = min_samples, **options)
+
+
+def bootstrap_intervals(means, levels, method = 'percentile', values = None):
+    """Percentile intervals of the output of `segment_bootstrap()`.
+
+    method = 'bca' and method = 'studentized' (with `means` the output of
+    `index_studentized()`) need `values`, {group: values of the group};
+    see `confidence_interval()`. A sample size of None stands for all the
+    values of the group and is labelled 'all', like `analytic_intervals()`.
+
+    Returns {level: frame} where every frame is indexed by group with
+    (sample size, lower / upper) columns, the same layout as
+    `analytic_intervals()`, so both can be passed to `ci_table()`.
+    """
+    rows = {level: {} for level in levels}
+    for group, sizes in means.items():
+        for size, m in sizes.items():
+            if method == 'percentile':
+                intervals = confidence_intervals(m, levels)
+            else:
+                intervals = {level: confidence_interval(m, level, method, values[group], size) for level in levels}
+            label = 'all' if size is None else size
+            for level, interval in intervals.items():
+                rows[level].setdefault(group, {})[(label, 'lower')] = interval[0]
+                rows[level].setdefault(group, {})[(label, 'upper')] = interval[1]
+
+    return {level: pd.DataFrame.from_dict(rows[level], orient = 'index') for level in levels}
+
+
+def segment_report(df, column, sample_sizes = (100, 1000, 5000, 50000), levels = (90, 95, 99),
+                   bootstrap_samples = 20000, rng = None, workers = None, kernel = 'numpy', memory_budget = None,
+                   cache = None, tol = None, method = 'percentile'):
+    """Compute-only version of the notebook's CLT curves for one column.
+
+    Returns {'means': {group: {sample_size: array}}, 'intervals': {level: frame}}
+    without building any figure. The notebook's `plot()` renders the same
+    means when figures are wanted. With `tol` the replicates stop once the
+    endpoints at every level are within `tol` dollars (see `index_bootstrap()`).
+
+    method is the interval of `bootstrap_intervals()`: 'percentile', 'bca'
+    or 'studentized'. The studentized intervals come from t statistics
+    (`index_studentized()`, which ignores kernel, cache and tol), returned
+    under 't' instead of 'means'.
+    """
+    index = SegmentIndex(df, column)
+    values = {g: index[g] for g in index.groups()}
+    if method == 'studentized':
+        stats = index_studentized(index, list(sample_sizes), bootstrap_samples, rng, workers, memory_budget)
+        return {'t': stats, 'intervals': bootstrap_intervals(stats, levels, method, values)}
+
+    means = index_bootstrap(index, list(sample_sizes), bootstrap_samples, rng, workers, kernel, memory_budget, cache,
+                            tol, levels)
+    return {'means': means, 'intervals': bootstrap_intervals(means, levels, method, values)}
+
+
+class ClusterIndex:
+    """Per customer totals of `value` inside every group of a column.
+
+    The rows are ordered by (group, customer) code once, like a compressed
+    sparse row index, and reduced to one total and one transaction count per
+    customer and group. Customers of a group are contiguous, starting at
+    `starts[g]` with `counts[g]` customers.
+    """
+
+    def __init__(self, df, column, cluster = 'User_ID', value = 'Purchase'):
+        index = SegmentIndex(df, [column, cluster], value)
+        cells = index.cells()
+
+        #transactions of every (group, customer) cell are contiguous in index.values
+        self.user_sum = np.add.reduceat(index.values, index.starts[cells], dtype = np.float64)
+        self.user_count = index.counts[cells].astype(np.float64)
+
+        group = cells // index.shape[1]
+        self.groups = index.categories[0]
+        self.present = np.unique(group)
+        self.counts = np.bincount(group, minlength = len(self.groups))[self.present]
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+
+def _cluster_stream(user_sum, user_count, starts, counts, replicates, seed):
+    #average purchase per transaction of `replicates` resamples of the customers of every group
+    rng = np.random.default_rng(seed)
+    means = np.empty((len(starts), replicates))
+
+    #one draw per customer position, summed per group
+    row_start, row_count = np.repeat(starts, counts), np.repeat(counts, counts)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    block = max(1, BLOCK_ELEMENTS // len(row_start))
+
+    for start in range(0, replicates, block):
+        stop = min(start + block, replicates)
+        idx = row_start + (rng.random((stop - start, len(row_start))) * row_count).astype(np.int64)
+        total = np.add.reduceat(user_sum[idx], offsets, axis = 1)
+        transactions = np.add.reduceat(user_count[idx], offsets, axis = 1)
+        means[:, start:stop] = (total / transactions).T
+
+    return means
+
+
+def cluster_bootstrap(df, column, bootstrap_samples = 20000, cluster = 'User_ID', value = 'Purchase', rng = None,
+                      workers = None):
+    """Customer level bootstrap of the average purchase per transaction of
+    every group of a column.
+
+    Transactions of the same customer are not independent, so customers
+    (`cluster`) are resampled with replacement inside each group and their
+    totals and transaction counts summed, using a `ClusterIndex` built once.
+    Runs in streams on the worker pool like `index_bootstrap()`.
+
+    Returns {group: array of bootstrap_samples means}.
+    """
+    index = ClusterIndex(df, column, cluster, value)
+    seeds = _seed_sequence(rng).spawn(_stream_count(bootstrap_samples))
+    means = _run_streams(_cluster_stream, (index.user_sum, index.user_count, index.starts, index.counts),
+                         bootstrap_samples, seeds, workers)
+    return {index.groups[g]: m for g, m in zip(index.present, means)}
+
+
+def cell_intervals(df, columns, sample_size = None, levels = (95,), bootstrap_samples = 20000, value = 'Purchase',
+                   rng = None, workers = None):
+    """Bootstrap intervals of the mean for every combination of the groups
+    of `columns` (e.g. Gender x Age x Marital_Status), resampled together in
+    one batched pass (see `index_bootstrap()`). By default every cell is
+    resampled at its own size, giving the interval of that cell's mean.
+
+    Returns a tidy frame with one row per cell and level: the labels of
+    `columns`, count, mean, level, lower and upper.
+    """
+    index = SegmentIndex(df, columns, value)
+    means = index_bootstrap(index, [sample_size], bootstrap_samples, rng, workers)
+
+    rows = []
+    for k in index.cells():
+        label = index.label(k)
+        labels = label if isinstance(label, tuple) else (label,)
+        cell = index.values[index.starts[k]:index.starts[k] + index.counts[k]]
+        for level, interval in confidence_intervals(means[label][sample_size], levels).items():
+            rows.append(labels + (len(cell), cell.mean(), level, interval[0], interval[1]))
+
+    return pd.DataFrame(rows, columns = index.columns + ['count', 'mean', 'level', 'lower', 'upper'])
+
+
+class PoissonBootstrap:
+    """Bootstrap of the per group mean of `value` for several columns, built
+    in one sequential pass over chunks of rows.
+
+    Every row gets an independent Poisson(1) weight in each of the
+    `bootstrap_samples` replicates, standing in for the number of times it
+    would be drawn, and the weighted sums and counts are accumulated per
+    replicate and group. No random access to the rows is needed, so chunks
+    of a file (`update()`) or separate shards (`merge()`, with a different
+    seed per shard) can be resampled independently and combined.
+    """
+
+    def __init__(self, columns = SEGMENT_COLUMNS, bootstrap_samples = 1000, value = 'Purchase', rng = None):
+        self.columns = list(columns)
+        self.bootstrap_samples = bootstrap_samples
+        self.value = value
+        self.rng = np.random.default_rng(rng)
+        self.labels = {c: [] for c in self.columns}
+        self.sums = {c: np.zeros((bootstrap_samples, 0)) for c in self.columns}
+        self.counts = {c: np.zeros((bootstrap_samples, 0)) for c in self.columns}
+
+    def _positions(self, column, groups):
+        #position of every group label in the accumulators, adding new labels
+        labels = self.labels[column]
+        new = [g for g in groups if g not in labels]
+        if new:
+            labels.extend(new)
+            pad = np.zeros((self.bootstrap_samples, len(new)))
+            self.sums[column] = np.hstack([self.sums[column], pad])
+            self.counts[column] = np.hstack([self.counts[column], pad])
+        return np.array([labels.index(g) for g in groups], dtype = np.int64)
+
+    def update(self, chunk):
+        v = _as_array(chunk[self.value]).astype(float)
+        codes = {}
+        for c in self.columns:
+            code, groups = segment_codes(chunk, c)
+            positions = self._positions(c, list(groups))
+            codes[c] = np.where(code >= 0, positions[code], -1)
+
+        #rows per block so that the (rows, replicates) weights stay within BLOCK_ELEMENTS
+        block = max(1, BLOCK_ELEMENTS // self.bootstrap_samples)
+        for start in range(0, len(v), block):
+            stop = min(start + block, len(v))
+            #one row of replicate weights per data row, so sorting rows moves contiguous memory
+            weights = self.rng.poisson(1.0, (stop - start, self.bootstrap_samples)).astype(float)
+            #value and 1 of every row, weighted into the sums and counts together
+            pairs = np.stack([v[start:stop], np.ones(stop - start)])
+
+            #rows of the block sorted by group once per column, then every group is
+            #one contiguous (2, rows) @ (rows, replicates) product, O(rows * replicates)
+            for c in self.columns:
+                code = codes[c][start:stop]
+                order = np.argsort(code, kind = 'stable')[np.count_nonzero(code < 0):]
+                rows = np.bincount(code[order], minlength = len(self.labels[c]))
+                present = np.flatnonzero(rows)
+                ends = np.cumsum(rows[present])
+
+                w, p = weights[order], pairs[:, order]
+                for g, lo, hi in zip(present, ends - rows[present], ends):
+                    sums, counts = p[:, lo:hi] @ w[lo:hi]
+                    self.sums[c][:, g] += sums
+                    self.counts[c][:, g] += counts
+        return self
+
+    def merge(self, other):
+        if other.bootstrap_samples != self.bootstrap_samples:
+            raise ValueError('bootstraps with different numbers of replicates cannot be merged')
+        for c in self.columns:
+            positions = self._positions(c, other.labels[c])
+            self.sums[c][:, positions] += other.sums[c]
+            self.counts[c][:, positions] += other.counts[c]
+        return self
+
+    def means(self, column):
+        """{group: array of replicate means} of a column, the layout of one
+        sample size of `segment_bootstrap()`."""
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            means = self.sums[column] / self.counts[column]
+        return {g: means[:, k] for k, g in enumerate(self.labels[column])}
+
+    def intervals(self, column, levels = (90, 95, 99)):
+        #percentile intervals per level, in the bootstrap_intervals() layout
+        return bootstrap_intervals({g: {'all': m} for g, m in self.means(column).items()}, levels)
+
+
+def poisson_bootstrap(path, columns = SEGMENT_COLUMNS, bootstrap_samples = 1000, value = 'Purchase',
+                      chunksize = 10**6, rng = None, engine = 'c'):
+    #Poisson bootstrap of a csv file read in chunks (see PoissonBootstrap)
+    boot = PoissonBootstrap(columns, bootstrap_samples, value, rng)
+    usecols = list(columns) + [value]
+    for chunk in pd.read_csv(path, usecols = usecols, dtype = _dtypes(usecols), chunksize = chunksize,
+                             engine = engine):
+        boot.update(clean_data(_categorize(chunk)))
+    return boot
+
+
+def _permutation_stream(values, counts, n_a, n_b, replicates, seed):
+    #differences in means of `replicates` random relabellings of a pooled value table
+    rng = np.random.default_rng(seed)
+    total = (values * counts).sum()
+    block = max(1, BLOCK_ELEMENTS // len(values))
+    diffs = np.empty((1, replicates))
+    for start in range(0, replicates, block):
+        stop = min(start + block, replicates)
+        draws = rng.multivariate_hypergeometric(counts, n_a, size = stop - start, method = 'marginals')
+        sum_a = draws @ values
+        diffs[0, start:stop] = sum_a / n_a - (total - sum_a) / n_b
+    return diffs
+
+
+def permutation_differences(a, b, permutations = 10000, rng = None, workers = None):
+    """Differences in means (a - b) after randomly relabelling the pooled
+    values of two groups `permutations` times.
+
+    A relabelling only changes which values go to group a, so every
+    permutation is drawn as the counts of each distinct pooled value that
+    land in a (a multivariate hypergeometric draw over the value table),
+    at a cost set by the number of distinct values rather than the number
+    of rows. Runs in streams on the worker pool like `index_bootstrap()`.
+    """
+    a, b = _as_array(a), _as_array(b)
+    values, counts = np.unique(np.concatenate([a, b]), return_counts = True)
+    seeds = _seed_sequence(rng).spawn(_stream_count(permutations))
+    return _run_streams(_permutation_stream, (values.astype(float), counts, len(a), len(b)),
+                        permutations, seeds, workers)[0]
+
+
+def compare_means(a, b, levels = (95,), bootstrap_samples = 5000, permutations = 5000, rng = None, workers = None,
+                  **options):
+    """Direct comparison of the average purchase of two groups.
+
+    Returns {'difference': mean(a) - mean(b), 'intervals': {level: array},
+    'p_value': two sided permutation p value, 'replicates': bootstrap
+    differences}. The interval comes from resampling each group at its own
+    size with `index_bootstrap()` and subtracting the replicate means, so
+    one call answers what comparing two separate intervals for overlap
+    only approximates. Further options (kernel, memory_budget, cache) are
+    passed to `index_bootstrap()`.
+    """
+    a, b = _as_array(a), _as_array(b)
+    root_boot, root_p = _seed_sequence(rng).spawn(2)
+    difference = a.mean() - b.mean()
+
+    #both groups in one index, resampled independently at their own sizes
+    groups = pd.DataFrame({'group': pd.Categorical(np.repeat(['a', 'b'], [len(a), len(b)])),
+                           'Purchase': np.concatenate([a, b])})
+    means = index_bootstrap(SegmentIndex(groups, 'group'), [None], bootstrap_samples, root_boot, workers, **options)
+    replicates = means['a'][None] - means['b'][None]
+    null = permutation_differences(a, b, permutations, root_p, workers)
+
+    return {'difference': difference,
+            'intervals': confidence_intervals(replicates, levels),
+            'p_value': (1 + np.count_nonzero(np.abs(null) >= abs(difference))) / (permutations + 1),
+            'replicates': replicates}
+
+
+def adjust_p_values(p_values, method = 'holm'):
+    """Correct p values for multiple comparisons.
+
+    method is 'bonferroni', 'holm' (family wise error, never less powerful
+    than bonferroni) or 'fdr_bh' (Benjamini-Hochberg false discovery rate).
+    """
+    p = np.asarray(p_values, dtype = float)
+    m = len(p)
+    if method == 'bonferroni':
+        return np.minimum(p * m, 1)
+
+    order = np.argsort(p)
+    if method == 'holm':
+        adjusted = np.maximum.accumulate(p[order] * (m - np.arange(m)))
+    elif method == 'fdr_bh':
+        adjusted = np.minimum.accumulate((p[order] * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f"unknown correction method: {method}")
+
+    result = np.empty(m)
+    result[order] = np.minimum(adjusted, 1)
+    return result
+
+
+def pairwise_comparisons(df, column, levels = (95,), bootstrap_samples = 5000, sample_size = None,
+                         correction = 'holm', simultaneous = False, value = 'Purchase', rng = None, workers = None):
+    """Difference in the mean of `value` between every pair of groups of a
+    categorical column.
+
+    All groups are bootstrapped together in one pass of `index_bootstrap()`
+    (each at its own size unless `sample_size` is given), and every pair
+    reuses those replicates, so 21 occupations cost one pass rather than
+    210 separate two group bootstraps. Groups are resampled independently,
+    which is what the difference of two replicate means needs.
+
+    P values are two sided bootstrap tests of a zero difference (share of
+    centred replicate differences at least as extreme as the observed one)
+    corrected over all pairs with `adjust_p_values()`. With simultaneous =
+    True the interval levels are widened by bonferroni so that all pairs
+    are covered at once.
+
+    Returns {'difference': frame, 'lower': {level: frame}, 'upper': {level:
+    frame}, 'p_value': frame} of group x group matrices, entry [a, b]
+    comparing a - b. The diagonal is empty.
+    """
+    index = SegmentIndex(df, column, value)
+    means = index_bootstrap(index, [sample_size], bootstrap_samples, rng, workers)
+    groups = list(means)
+    replicates = np.array([means[g][sample_size] for g in groups])
+    observed = np.array([index[g].mean() for g in groups])
+
+    #every unordered pair once, as rows of a (pairs, bootstrap_samples) array
+    a, b = np.triu_indices(len(groups), 1)
+    differences = replicates[a] - replicates[b]
+    difference = observed[a] - observed[b]
+
+    #interval levels, widened to cover all pairs at once if asked
+    levels = list(levels)
+    widened = [100 - (100 - level) / len(a) for level in levels] if simultaneous else levels
+    tails = [[(100 - level) / 2, (100 + level) / 2] for level in widened]
+    bounds = np.percentile(differences, np.ravel(tails), axis = 1).round(0)
+
+    #bootstrap test: replicate differences shifted to a zero mean difference
+    extreme = np.abs(differences - differences.mean(axis = 1, keepdims = True)) >= np.abs(difference)[:, None]
+    p_values = adjust_p_values((1 + extreme.sum(axis = 1)) / (bootstrap_samples + 1), correction)
+
+    def matrix(upper, lower, diagonal = np.nan):
+        #group x group frame from one value per pair, [b, a] holding the mirrored value
+        m = np.full((len(groups), len(groups)), diagonal)
+        m[a, b], m[b, a] = upper, lower
+        return pd.DataFrame(m, index = pd.Index(groups, name = column), columns = groups)
+
+    result = {'difference': matrix(difference, -difference), 'lower': {}, 'upper': {},
+              'p_value': matrix(p_values, p_values)}
+    for k, level in enumerate(levels):
+        low, high = bounds[2 * k], bounds[2 * k + 1]
+        result['lower'][level] = matrix(low, -high)
+        result['upper'][level] = matrix(high, -low)
+    return result
+
+
+def segment_stats(df, column, value = 'Purchase'):
+    #count, mean and variance of the purchase amount for every group of column
+    return df.groupby(column, observed = True)[value].agg(['count', 'mean', 'var'])
+
+
+class QuantileSketch:
+    """Mergeable summary of a value column for quantiles and box plots.
+
+    Values are counted in bins of `width` (one bin per value with the default
+    width of 1, which is exact for the integer Purchase amounts) held as a
+    dense count array from the lowest bin seen, so the sketch grows with the
+    range of the values, not with rows. An update is one bincount without
+    sorting, and two sketches of separate chunks or shards combine with
+    `merge()`.
+    Quantiles are off by at most one bin width.
+    """
+
+    def __init__(self, width = 1):
+        self.width = width
+        #dense counts of the bins offset, offset + 1, ...
+        self.offset = 0
+        self.counts = np.empty(0, np.int64)
+
+    @property
+    def bins(self):
+        return self.offset + np.arange(len(self.counts))
+
+    def _combine(self, offset, counts):
+        if not len(self.counts):
+            self.offset, self.counts = offset, counts
+            return self
+        if not len(counts):
+            return self
+        lo = min(self.offset, offset)
+        hi = max(self.offset + len(self.counts), offset + len(counts))
+        combined = np.zeros(hi - lo, np.int64)
+        combined[self.offset - lo:self.offset - lo + len(self.counts)] += self.counts
+        combined[offset - lo:offset - lo + len(counts)] += counts
+        self.offset, self.counts = lo, combined
+        return self
+
+    def update(self, values):
+        bins = np.floor(_as_array(values) / self.width).astype(np.int64)
+        if not len(bins):
+            return self
+        offset = int(bins.min())
+        return self._combine(offset, np.bincount(bins - offset).astype(np.int64))
+
+    def merge(self, other):
+        if other.width != self.width:
+            raise ValueError('sketches with different bin widths cannot be merged')
+        return self._combine(other.offset, other.counts.copy())
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def values(self):
+        #representative value of every bin, the value itself for width 1
+        return self.bins * self.width + (self.width - 1) / 2
+
+    def quantile(self, q):
+        """Quantiles with the linear interpolation of np.percentile."""
+        q = np.asarray(q, dtype = float)
+        pos = q * (self.count - 1)
+        ends = np.cumsum(self.counts)
+        values = self.values()
+        lower = values[np.searchsorted(ends, np.floor(pos), side = 'right')]
+        upper = values[np.searchsorted(ends, np.ceil(pos), side = 'right')]
+        return lower + (upper - lower) * (pos - np.floor(pos))
+
+    def boxplot_stats(self, whis = 1.5, label = None):
+        """Box plot statistics in the form taken by matplotlib's Axes.bxp:
+        quartiles, whiskers at the furthest values within whis * IQR, and
+        the distinct values beyond them as fliers."""
+        q1, med, q3 = self.quantile([0.25, 0.5, 0.75])
+        values = self.values()[self.counts > 0]
+        inside = values[(values >= q1 - whis * (q3 - q1)) & (values <= q3 + whis * (q3 - q1))]
+        stats = {'q1': q1, 'med': med, 'q3': q3, 'whislo': inside.min(), 'whishi': inside.max(),
+                 'fliers': values[(values < inside.min()) | (values > inside.max())],
+                 'mean': (self.values() * self.counts).sum() / self.count}
+        if label is not None:
+            stats['label'] = label
+        return stats
+
+
+def segment_sketches(df, column, value = 'Purchase', width = 1):
+    #quantile sketch of value for every group of column
+    index = SegmentIndex(df, column, value)
+    return {index.label(k): QuantileSketch(width).update(index.values[index.starts[k]:index.starts[k] + index.counts[k]])
+            for k in index.cells()}
+
+
+def kde_curve(data, weights = None, bins = 1024, bw_adjust = 1, cut = 3):
+    """Gaussian kernel density curve of `data` on `bins` grid points.
+
+    The data (optionally with the number of times each value occurs, e.g.
+    the values and counts of a `QuantileSketch`) are linearly binned onto the grid and convolved with
+    the kernel by FFT, so the cost is O(bins log bins) after one pass over
+    the data. The bandwidth is Scott's rule like seaborn's kdeplot, times
+    bw_adjust, and the grid extends `cut` bandwidths past the data.
+
+    Returns the grid points and the density at each of them.
+    """
+    data = _as_array(data).astype(float)
+    weights = np.ones(len(data)) if weights is None else _as_array(weights).astype(float)
+    total = weights.sum()
+
+    #scott's rule, weights count how many times each value occurs
+    mean = (data * weights).sum() / total
+    std = np.sqrt((weights * (data - mean)**2).sum() / (total - 1))
+    h = std * total**(-1 / 5) * bw_adjust
+    if h == 0:
+        h = 1.0
+
+    grid = np.linspace(data.min() - cut * h, data.max() + cut * h, bins)
+    delta = grid[1] - grid[0]
+
+    #linear binning, every point shares its weight between its two nearest grid points
+    pos = (data - grid[0]) / delta
+    left = np.minimum(np.floor(pos).astype(np.int64), bins - 2)
+    frac = pos - left
+    counts = (np.bincount(left, weights * (1 - frac), minlength = bins)
+              + np.bincount(left + 1, weights * frac, minlength = bins)) / total
+
+    #gaussian kernel on the grid spacing, zero padded so the convolution does not wrap
+    reach = min(bins - 1, int(np.ceil(5 * h / delta)))
+    offsets = np.arange(-reach, reach + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / h)**2) / (h * np.sqrt(2 * np.pi))
+    size = 1 << int(np.ceil(np.log2(bins + 2 * reach + 1)))
+    density = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)[reach:reach + bins]
+
+    return grid, np.maximum(density, 0)
+
+
+class PurchaseCube:
+    """Count, sum and sum of squares of `value` for every combination of the
+    groups of `columns`, built with one pass over the category codes.
+
+    Roll ups to any subset of the columns (`rollup()`) sum over the other
+    axes of the cube, so the sales share, per purchase and analytic interval
+    tables are answered without touching the rows again.
+    """
+
+    def __init__(self, df, columns = CUBE_COLUMNS, value = 'Purchase'):
+        self.columns = list(columns)
+        codes, self.categories = zip(*[segment_codes(df, c) for c in self.columns])
+        self.shape = tuple(len(c) for c in self.categories)
+
+        valid = np.logical_and.reduce([c >= 0 for c in codes])
+        key = np.ravel_multi_index(tuple(c[valid] for c in codes), self.shape)
+        v = _as_array(df[value])[valid].astype(float)
+
+        size = int(np.prod(self.shape))
+        self.count = np.bincount(key, minlength = size).reshape(self.shape)
+        self.sum = np.rint(np.bincount(key, v, minlength = size)).astype(np.int64).reshape(self.shape)
+        self.sum_sq = np.bincount(key, v * v, minlength = size).reshape(self.shape)
+
+    def rollup(self, columns):
+        """Frame of count, sum and sum_sq per group of `columns` (one column
+        name or a list), leaving out empty groups."""
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        axes = tuple(i for i, c in enumerate(self.columns) if c not in columns)
+        keep = [self.columns.index(c) for c in columns]
+
+        #summing over the other columns and putting the kept ones in the requested order
+        order = np.argsort(np.argsort(keep))
+        count, total, sum_sq = (np.transpose(a.sum(axis = axes), order).ravel()
+                                for a in (self.count, self.sum, self.sum_sq))
+
+        index = pd.MultiIndex.from_product([self.categories[i] for i in keep], names = columns)
+        if len(columns) == 1:
+            index = pd.Index(index.get_level_values(0), name = columns[0])
+
+        frame = pd.DataFrame({'count': count, 'sum': total, 'sum_sq': sum_sq}, index = index)
+        return frame[frame['count'] > 0]
+
+
+def _add_sums(total, part):
+    #adds two sum tables, keeping integer columns exact
+    if total is None:
+        return part
+    labels = total.index.union(part.index)
+    return total.reindex(labels, fill_value = 0) + part.reindex(labels, fill_value = 0)
+
+
+def _bottom_k(keys, values, k):
+    #the k values with the smallest random keys, a uniform sample without replacement
+    if len(keys) <= k:
+        return keys, values
+    keep = np.argpartition(keys, k)[:k]
+    return keys[keep], values[keep]
+
+
+def stream_segments(path, columns = SEGMENT_COLUMNS, value = 'Purchase', chunksize = 10**6,
+                    reservoir_size = 50000, rng = None, engine = 'c', sketch_width = 1):
+    """Per segment sums and samples of `value` from one chunked pass over a
+    csv file that does not fit in memory.
+
+    For every column returns {'sums': frame, 'reservoir': {group: array},
+    'sketch': {group: QuantileSketch}}, where the frame is indexed by group
+    with count, sum and sum_sq columns (the notebook's groupby sum / count
+    tables, see `sums_to_stats()` for the analytic interval inputs), every
+    group keeps a uniform random sample of at most `reservoir_size` of its
+    values for the bootstrap, and a quantile sketch for its box plot.
+    Memory depends on the chunk size, reservoirs and sketches, not on the
+    file.
+    """
+    rng = np.random.default_rng(rng)
+    columns = list(columns)
+    sums = {c: None for c in columns}
+    reservoirs = {c: {} for c in columns}
+    sketches = {c: {} for c in columns}
+
+    usecols = columns + [value]
+    for chunk in pd.read_csv(path, usecols = usecols, dtype = _dtypes(usecols), chunksize = chunksize,
+                             engine = engine):
+        chunk = _categorize(chunk)
+        v = chunk[value].values.astype(np.int64)
+
+        #random key of every row, the rows with the smallest keys form the reservoir
+        keys = rng.random(len(chunk))
+
+        for c in columns:
+            #each group's rows of the chunk are one slice of the index, summed with reduceat
+            index = SegmentIndex(chunk, c, value)
+            cells = index.cells()
+            if not len(cells):
+                continue
+            grouped = v[index.rows]
+            part = pd.DataFrame({'count': index.counts[cells],
+                                 'sum': np.add.reduceat(grouped, index.starts[cells]),
+                                 'sum_sq': np.add.reduceat(grouped * grouped, index.starts[cells])},
+                                index = pd.Index([index.label(k) for k in cells], name = c))
+            sums[c] = _add_sums(sums[c], part)
+
+            #merging each group's rows of the chunk into its reservoir
+            index_keys = keys[index.rows]
+            for k in cells:
+                rows = slice(index.starts[k], index.starts[k] + index.counts[k])
+                label = index.label(k)
+                old_keys, old_values = reservoirs[c].get(label, (np.empty(0), np.empty(0, index.values.dtype)))
+                reservoirs[c][label] = _bottom_k(np.concatenate([old_keys, index_keys[rows]]),
+                                                 np.concatenate([old_values, index.values[rows]]),
+                                                 reservoir_size)
+                sketches[c].setdefault(label, QuantileSketch(sketch_width)).update(index.values[rows])
+
+    #groups in category order, with the notebook's marital status labels
+    result = {}
+    for c in columns:
+        labels = MARITAL_STATUS if c == 'Marital_Status' else {}
+        result[c] = {'sums': sums[c].sort_index().rename(index = labels),
+                     'reservoir': {labels.get(g, g): r[1] for g, r in sorted(reservoirs[c].items())},
+                     'sketch': {labels.get(g, g): k for g, k in sorted(sketches[c].items())}}
+
+    return result
+
+
+def sums_to_stats(sums):
+    #count, mean and variance (the segment_stats() layout) from count, sum and sum_sq
+    count = sums['count']
+    mean = sums['sum'] / count
+    var = (sums['sum_sq'] - sums['sum'] * mean) / (count - 1)
+    return pd.DataFrame({'count': count, 'mean': mean, 'var': var})
+
+
+def segment_moments(df, column, value = 'Purchase'):
+    #count, mean and sum of squared deviations (m2) of value for every group of column
+    m = df.groupby(column, observed = True)[value].agg(['count', 'mean', 'var'])
+    m['m2'] = (m.pop('var') * (m['count'] - 1)).fillna(0)
+    m.index = pd.Index(list(m.index), name = column)
+    return m
+
+
+def merge_moments(a, b):
+    """Combine two tables of per group count, mean and m2 (Chan et al.'s
+    parallel form of Welford's update), as if their rows had been
+    summarised together. Groups missing from one side are kept as is."""
+    if a is None:
+        return b
+    labels = a.index.append(b.index.difference(a.index, sort = False))
+    a = a.reindex(labels, fill_value = 0)
+    b = b.reindex(labels, fill_value = 0)
+
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    share = (b['count'] / count.where(count > 0, 1))
+    return pd.DataFrame({'count': count,
+                         'mean': a['mean'] + delta * share,
+                         'm2': a['m2'] + b['m2'] + delta**2 * a['count'] * share})
+
+
+def file_moments(path, columns = SEGMENT_COLUMNS, value = 'Purchase', chunksize = 10**6, engine = 'c'):
+    #per group moments of every column from one chunked pass over a csv file
+    columns = list(columns)
+    moments = {c: None for c in columns}
+    usecols = columns + [value]
+    for chunk in pd.read_csv(path, usecols = usecols, dtype = _dtypes(usecols), chunksize = chunksize,
+                             engine = engine):
+        chunk = clean_data(_categorize(chunk))
+        for c in columns:
+            moments[c] = merge_moments(moments[c], segment_moments(chunk, c, value))
+    return moments
+
+
+def _read_store(store_path):
+    if not os.path.exists(store_path):
+        return {'batches': [], 'columns': {}}
+    with open(store_path) as f:
+        return json.load(f)
+
+
+def load_moments(store_path):
+    """Per group moments saved by `update_moments()`, as {column: frame}."""
+    store = _read_store(store_path)
+    return {c: pd.DataFrame(m['values'], index = pd.Index(m['labels'], name = c), columns = ['count', 'mean', 'm2'])
+                .astype({'count': 'int64'})
+            for c, m in store['columns'].items()}
+
+
+def update_moments(store_path, path, columns = SEGMENT_COLUMNS, value = 'Purchase', chunksize = 10**6,
+                   engine = 'c'):
+    """Fold a new transaction file into the moment store at `store_path`.
+
+    Only the new file is read; its per group moments are merged into the
+    stored ones with `merge_moments()`. Files are identified by their
+    content hash, so folding the same batch twice does nothing.
+    Returns the updated {column: frame}.
+    """
+    store = _read_store(store_path)
+    digest = file_hash(path)
+    moments = load_moments(store_path)
+    if digest in store['batches']:
+        return moments
+
+    for c, m in file_moments(path, columns, value, chunksize, engine).items():
+        moments[c] = merge_moments(moments.get(c), m)
+
+    store['batches'].append(digest)
+    store['columns'] = {c: {'labels': [l.item() if hasattr(l, 'item') else l for l in m.index],
+                            'values': m.astype(float).values.tolist()}
+                        for c, m in moments.items()}
+
+    #written to a temporary file first so an interrupted update keeps the old store
+    with open(f'{store_path}.tmp', 'w') as f:
+        json.dump(store, f)
+    os.replace(f'{store_path}.tmp', store_path)
+    return moments
+
+
+def moments_to_stats(moments):
+    #count, mean and variance (the segment_stats() layout) from count, mean and m2
+    return pd.DataFrame({'count': moments['count'], 'mean': moments['mean'],
+                         'var': moments['m2'] / (moments['count'] - 1)})
+
+
+def sales_table(moments):
+    """The notebook's purchase amount table (sum, count, sum_in_billions,
+    %sum and per_purchase) from per group moments, or from the count and sum
+    columns of `stream_segments()` sums or a `PurchaseCube` roll up."""
+    total = moments['sum'] if 'sum' in moments else (moments['mean'] * moments['count']).round().astype('int64')
+    temp = pd.DataFrame({'sum': total, 'count': moments['count']})
+    temp['sum_in_billions'] = round(temp['sum'] / 10**9, 2)
+    temp['%sum'] = round(temp['sum'] / temp['sum'].sum(), 3)
+    temp['per_purchase'] = round(temp['sum'] / temp['count'])
+    return temp.reset_index()
+
+
+def analytic_intervals(stats, ci, sample_sizes, method = 't'):
+    """Closed form confidence intervals for the mean of every segment.
+
+    `stats` is a frame with count, mean and var columns indexed by group (see
+    `segment_stats()`). For every sample size n the interval is
+    mean +/- crit * sqrt(var / n), where crit comes from the t distribution
+    with n - 1 degrees of freedom (method = 't') or the standard normal
+    (method = 'normal'). A sample size of None uses the full group count.
+
+    Returns a frame indexed by group with (sample size, lower / upper)
+    columns, matching the layout of the bootstrap summaries.
+    """
+    if method not in ('t', 'normal'):
+        raise ValueError(f"unknown interval method {method!r}")
+
+    alpha = (100 - ci) / 200
+    result = {}
+    for size in sample_sizes:
+        n = stats['count'] if size is None else pd.Series(size, index = stats.index)
+
+        #critical value of the chosen distribution
+        if method == 't':
+            crit = t.ppf(1 - alpha, n - 1)
+        else:
+            crit = norm.ppf(1 - alpha)
+
+        margin = crit * np.sqrt(stats['var'] / n)
+        label = 'all' if size is None else size
+        result[(label, 'lower')] = (stats['mean'] - margin).round(0)
+        result[(label, 'upper')] = (stats['mean'] + margin).round(0)
+
+    return pd.DataFrame(result)
+
+
+def format_interval(interval):
+    #text used in the confidence interval summary tables
+    return f"CI = ${interval[0]:.0f} - ${interval[1]:.0f}, Range = {(interval[1] - interval[0]):.0f}"
+
+
+def ci_table(intervals):
+    """Turn a frame of (sample size, lower / upper) columns into the rows of
+    text shown in the confidence interval summary tables."""
+    sizes = intervals.columns.get_level_values(0).unique()
+    return [[str(group)] + [format_interval(intervals.loc[group, size].values) for size in sizes]
+            for group in intervals.index]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Bootstrap confidence intervals of the average purchase amount.')
+    parser.add_argument('path', help = 'walmart_data csv file')
+    parser.add_argument('columns', nargs = '+', help = 'categorical columns to segment by')
+    parser.add_argument('--sample-sizes', type = int, nargs = '+', default = [100, 1000, 5000, 50000])
+    parser.add_argument('--levels', type = int, nargs = '+', default = [90, 95, 99])
+    parser.add_argument('--bootstrap-samples', type = int, default = 20000,
+                        help = 'replicates per sample size, the upper limit with --tol')
+    parser.add_argument('--method', choices = ['percentile', 'bca', 'studentized'], default = 'percentile',
+                        help = 'bootstrap interval')
+    parser.add_argument('--tol', type = float, default = None,
+                        help = 'stop adding replicates once every interval endpoint is within this many dollars')
+    parser.add_argument('--seed', type = int, default = None)
+    parser.add_argument('--workers', type = int, default = None, help = 'worker threads, all cores by default')
+    parser.add_argument('--kernel', choices = sorted(KERNELS), default = 'numpy',
+                        help = "resampling kernel, 'fused' needs numba")
+    parser.add_argument('--bootstrap-cache', help = 'directory reusing the means of runs with the same --seed')
+    parser.add_argument('--memory-budget', help = 'working memory of the bootstrap, such as 2G')
+    parser.add_argument('--engine', default = 'c', help = "csv parser engine, 'pyarrow' for the multithreaded one")
+    parser.add_argument('--out', help = 'directory for <column>_<level>.csv tables, printed when omitted')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'parse the csv file instead of using its cache')
+    args = parser.parse_args(argv)
+
+    columns = list(args.columns) + ['Purchase']
+    if args.no_cache:
+        df = clean_data(load_data(args.path, usecols = columns, engine = args.engine))
+    else:
+        df = load_cached(args.path, columns = columns, engine = args.engine)
+
+    for column in args.columns:
+        if args.memory_budget:
+            plan = plan_bootstrap(SegmentIndex(df, column), args.sample_sizes, args.bootstrap_samples, args.workers,
+                                  args.memory_budget, args.kernel)
+            print(f"{column} - planned peak {plan['peak'] / 2**20:.0f} MB on {plan['workers']} workers",
+                  file = sys.stderr)
+        report = segment_report(df, column, args.sample_sizes, args.levels, args.bootstrap_samples, args.seed,
+                                args.workers, args.kernel, args.memory_budget, args.bootstrap_cache, args.tol,
+                                args.method)
+        for level, intervals in report['intervals'].items():
+            if args.out:
+                os.makedirs(args.out, exist_ok = True)
+                intervals.to_csv(os.path.join(args.out, f'{column}_{level}.csv'))
+            else:
+                print(f'{column} - {level}% Confidence Interval')
+                for row in ci_table(intervals):
+                    print(row)
+                print('-' * 70)
+
+
+if __name__ == '__main__':
+    main()